@@ -0,0 +1,146 @@
+import argparse
+import json
+import sys
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+from game_engine import GameEngine
+from player_state import QUEST_FLAGS
+from storage import BaseStorage, create_storage
+
+# Обслуживание базы игроков без загрузки всех в память: игроки перебираются по одному
+# (потоковое чтение JSON или постраничный SELECT), изменения пишутся пачками.
+# Для бэкендов json и journal бот должен быть остановлен: он держит игроков в памяти
+# и при следующей записи затрет изменения.
+#   python admin.py stats
+#   python admin.py count --scene lab_x18
+#   python admin.py count --scene lab_x18_in --without-item pistol --not-flag has_killed   (погибли в go_room)
+#   python admin.py list --invalid-scene
+#   python admin.py reset --invalid-scene --yes
+#   python admin.py set --scene shop current_scene=sidorovich --yes
+
+Filter = Callable[[Dict[str, Any]], bool]
+
+
+def build_filters(args) -> List[Filter]:
+    filters = []
+    if args.scene:
+        filters.append(lambda user: user.get("current_scene") == args.scene)
+    if args.invalid_scene:
+        filters.append(lambda user: user.get("current_scene") not in GameEngine.SCENES)
+    for flag in args.flag:
+        filters.append(lambda user, flag=flag: bool(user.get(flag)))
+    for flag in args.not_flag:
+        filters.append(lambda user, flag=flag: not user.get(flag))
+    for item in args.with_item:
+        filters.append(lambda user, item=item: item in user.get("inventory", []))
+    for item in args.without_item:
+        filters.append(lambda user, item=item: item not in user.get("inventory", []))
+    return filters
+
+
+def matches(user: Dict[str, Any], filters: List[Filter]) -> bool:
+    return all(check(user) for check in filters)
+
+
+# Сводка за один проход: игроки по сценам, флагам и предметам
+def collect_stats(storage: BaseStorage, filters: List[Filter]) -> Dict[str, Any]:
+    total = 0
+    scenes = Counter()
+    flags = Counter()
+    items = Counter()
+    for user in storage.scan():
+        if not matches(user, filters):
+            continue
+        total += 1
+        scenes[user.get("current_scene")] += 1
+        flags.update(flag for flag in QUEST_FLAGS if user.get(flag))
+        items.update(set(user.get("inventory", [])))
+    return {"total": total, "scenes": scenes, "flags": flags, "items": items}
+
+
+def parse_assignments(assignments: List[str]) -> Dict[str, Any]:
+    updates = {}
+    for assignment in assignments:
+        key, separator, value = assignment.partition("=")
+        if not separator:
+            raise ValueError(f"Ожидалось поле=значение: {assignment}")
+        try:
+            updates[key] = json.loads(value)
+        except json.JSONDecodeError:
+            # Строки можно писать без кавычек
+            updates[key] = value
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Статистика и пакетные изменения игроков")
+    parser.add_argument("command", choices=["stats", "count", "list", "reset", "set"])
+    parser.add_argument("assignments", nargs="*", help="для set: поле=значение (значение в JSON или строкой)")
+    parser.add_argument("--scene", help="игроки в этой сцене")
+    parser.add_argument("--invalid-scene", action="store_true", help="игроки в несуществующей сцене")
+    parser.add_argument("--flag", action="append", default=[], help="флаг квеста установлен")
+    parser.add_argument("--not-flag", action="append", default=[], help="флаг квеста не установлен")
+    parser.add_argument("--with-item", action="append", default=[], help="предмет есть в инвентаре")
+    parser.add_argument("--without-item", action="append", default=[], help="предмета нет в инвентаре")
+    parser.add_argument("--limit", type=int, default=50, help="для list: сколько игроков показать")
+    parser.add_argument("--chunk-size", type=int, default=500, help="сколько изменений писать за раз")
+    parser.add_argument("--yes", action="store_true", help="для reset/set: применить, а не только посчитать")
+    args = parser.parse_intermixed_args()
+
+    filters = build_filters(args)
+    # Без фонового вытеснения: игроки не должны переезжать в холодный ярус, пока их читают
+    storage = create_storage(evict_interval=0)
+    try:
+        if args.command == "stats":
+            stats = collect_stats(storage, filters)
+            print(f"Игроков: {stats['total']}")
+            for title, counter in (("Сцены", stats["scenes"]), ("Флаги", stats["flags"]),
+                                   ("Предметы", stats["items"])):
+                print(f"\n{title}:")
+                for name, count in counter.most_common():
+                    print(f"  {name}: {count}")
+
+        elif args.command == "count":
+            print(sum(1 for user in storage.scan() if matches(user, filters)))
+
+        elif args.command == "list":
+            shown = 0
+            for user in storage.scan():
+                if shown >= args.limit:
+                    break
+                if matches(user, filters):
+                    print(f"{user['user_id']}\t{user.get('user_name', '')}\t{user.get('current_scene')}")
+                    shown += 1
+
+        else:
+            if args.command == "set":
+                updates = parse_assignments(args.assignments)
+                if not updates:
+                    parser.error("set: укажите хотя бы одно поле=значение")
+            if not filters:
+                parser.error(f"{args.command}: без фильтров изменились бы все игроки, укажите фильтр")
+
+            if not args.yes:
+                count = sum(1 for user in storage.scan() if matches(user, filters))
+                print(f"Будет изменено игроков: {count}. Повторите с --yes, чтобы применить")
+                return
+
+            def select(user):
+                if not matches(user, filters):
+                    return None
+                if args.command == "reset":
+                    return storage._create_default_user(str(user["user_id"]))
+                return updates
+
+            print(f"Изменено игроков: {storage.bulk_update(select, args.chunk_size)}")
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
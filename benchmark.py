@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import Application
+
+import bot
+from fake_telegram import create_fake_bot, make_callback_update, make_message_update
+from rate_limiter import FloodRateLimiter
+from storage import Storage
+
+# Нагрузочный прогон: N игроков одновременно проходят квест через настоящие хендлеры,
+# Telegram подменен локальным поддельным API, хранилище создается во временной папке.
+# python benchmark.py --users 1000 --backend sqlite
+# python benchmark.py --users 50 --rate-limit --flood-every 100  - проверка реакции на 429
+
+# Полное прохождение: имя -> Сидорович -> улица -> дом -> лаборатория -> комната -> документы
+PLAYTHROUGH = [
+    ("text", "/start"),
+    ("text", "Меченый"),
+    ("action", "next"),
+    ("action", "next1"),
+    ("action", "next2"),
+    ("action", "buy_gun"),
+    ("action", "street"),
+    ("action", "talk_stalker"),
+    ("action", "search_house"),
+    ("action", "search"),
+    ("action", "back"),
+    ("action", "lab_x18"),
+    ("action", "try_door"),
+    ("action", "use_key"),
+    ("action", "lab_x18_in"),
+    ("action", "go_room"),
+    ("action", "shoot"),
+    ("action", "search_doc"),
+    ("action", "back"),
+    ("action", "back"),
+    ("action", "to_sidr"),
+    ("action", "give_doc"),
+]
+
+
+def create_benchmark_storage(backend: str, directory: str, flush_interval: float):
+    if backend == "json":
+        return Storage(os.path.join(directory, "users.json"), flush_interval=flush_interval)
+    if backend == "journal":
+        from storage import JournaledStorage
+        return JournaledStorage(os.path.join(directory, "users.json"))
+    if backend == "sqlite":
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(os.path.join(directory, "users.db"))
+    raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+async def play(application: Application, user_id: int, update_ids, latencies):
+    for kind, payload in PLAYTHROUGH:
+        if kind == "text":
+            data = make_message_update(next(update_ids), user_id, payload)
+        else:
+            data = make_callback_update(next(update_ids), user_id, f"action_{payload}")
+        update = Update.de_json(data, application.bot)
+
+        started = time.perf_counter()
+        await application.process_update(update)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_benchmark(users: int, backend: str, flush_interval: float, rate_limit: bool = False,
+                        flood_every: int = 0, persistence: bool = False):
+    with tempfile.TemporaryDirectory() as directory:
+        storage = create_benchmark_storage(backend, directory, flush_interval)
+        bot.open_storage(storage)
+
+        rate_limiter = FloodRateLimiter() if rate_limit else None
+        fake_bot, request = await create_fake_bot(rate_limiter, flood_every)
+        builder = Application.builder().bot(fake_bot).updater(None)
+        if persistence:
+            builder = builder.persistence(bot.create_persistence())
+        application = builder.build()
+        bot.register_handlers(application)
+
+        latencies = []
+        update_ids = itertools.count(1)
+        async with application:
+            started = time.perf_counter()
+            await asyncio.gather(*(play(application, user_id, update_ids, latencies)
+                                   for user_id in range(1, users + 1)))
+            if persistence:
+                await application.update_persistence()
+            await bot.storage.flush()
+            elapsed = time.perf_counter() - started
+
+        finished = sum(storage.get_user(str(user_id))["current_scene"] == "end" for user_id in range(1, users + 1))
+        await bot.storage.close()
+
+    latencies.sort()
+    print(f"Бэкенд: {backend}, игроков: {users}, апдейтов: {len(latencies)}")
+    print(f"Время: {elapsed:.2f} с, пропускная способность: {len(latencies) / elapsed:.0f} апдейтов/с")
+    print(f"Задержка p50: {percentile(latencies, 0.5) * 1000:.2f} мс, "
+          f"p99: {percentile(latencies, 0.99) * 1000:.2f} мс")
+    print(f"Прошли квест до конца: {finished} из {users}")
+    print(f"Записано в хранилище: {storage.bytes_written} байт, прочитано: {storage.bytes_read} байт, "
+          f"fsync: {storage.fsyncs}")
+    print(f"Запросов к Bot API: {sum(request.calls.values())} {dict(request.calls)}")
+    if rate_limiter is not None:
+        print(f"Планировщик отправки: {dict(rate_limiter.stats)}, ожидание {rate_limiter.wait_seconds:.1f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест хендлеров бота без сети")
+    parser.add_argument("--users", type=int, default=100, help="сколько игроков играют одновременно")
+    parser.add_argument("--backend", choices=["json", "journal", "sqlite"], default="json")
+    parser.add_argument("--flush-interval", type=float, default=5, help="FLUSH_INTERVAL для json")
+    parser.add_argument("--edit-messages", action="store_true", help="включить EDIT_MESSAGES")
+    parser.add_argument("--persistence", action="store_true",
+                        help="держать игроков в context.user_data (PERSISTENCE)")
+    parser.add_argument("--rate-limit", action="store_true", help="отправлять через FloodRateLimiter")
+    parser.add_argument("--flood-every", type=int, default=0,
+                        help="поддельный API отвечает 429 на каждую N-ю отправку")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    bot.EDIT_MESSAGES = args.edit_messages
+    asyncio.run(run_benchmark(args.users, args.backend, args.flush_interval, args.rate_limit, args.flood_every,
+                              args.persistence))
+
+
+if __name__ == "__main__":
+    main()
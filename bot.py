@@ -1,463 +1,513 @@
+import asyncio
 import logging
 import random
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
-    CallbackQueryHandler, ContextTypes, filters
+    CallbackQueryHandler, ContextTypes, TypeHandler, filters
 )
-from config import TOKEN
-from storage import Storage
+from config import (
+    TOKEN, CONCURRENT_UPDATES, STORAGE_SHARDS, UPDATE_QUEUE_SIZE, EDIT_MESSAGES,
+    PERSISTENCE, PERSISTENCE_INTERVAL,
+    ADMIN_IDS, METRICS_PATH, METRICS_LOG_INTERVAL,
+    PROFILE_SAMPLE_RATE, PROFILE_SLOW_THRESHOLD, PROFILE_DIR, PROFILE_DUMP_INTERVAL, TRACE_FILE,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+)
+from storage import AsyncStorage, BaseStorage, UserSession, create_storage
 from game_engine import GameEngine
+from dispatcher import dispatcher
+from player_state import PlayerState
+from inventory import Inventory
+from webhook import ALLOWED_UPDATES, run_webhook
+from rate_limiter import create_rate_limiter
+from metrics import metrics, log_periodically
+from profiler import SamplingProfiler
+from persistence import StoragePersistence
+from update_trace import TraceRecorder
+from keyboards import (
+    generate_keyboard, MENU_KEYBOARD, BACK_TO_MENU_KEYBOARD, INVENTORY_KEYBOARD, BACK_KEYBOARD,
+    SHOP_KEYBOARD, INTRO_KEYBOARD, CRASH_KEYBOARD, WAKE_UP_KEYBOARD, USE_KEY_KEYBOARD,
+    ENTER_LAB_KEYBOARD, SHOOT_KEYBOARD
+)
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
-storage = Storage()
-
-
-# Генерация клавиатуры для сцены
-def generate_keyboard(scene_id, user_data):
-    actions = GameEngine.get_scene_actions(scene_id)
-    keyboard = []
-
-    action_map = {
-        "shop": "🛒 Магазин",
-        "street": "🚪 Выйти на улицу",
-        "lab_x18": "☢️ Идти в лабораторию X18",
-        "talk_stalker": "🗣️ Поговорить со сталкером",
-        "search_house": "🏚️ Зайти в дом",
-        "back": "🔙 Назад",
-        "try_door": "🔒 Открыть дверь",
-        "use_key": "🔑 Использовать ключ",
-        "search": "🔍 Обыскать комнаты",
-        "go_room": "Рискнуть и пойти в комнату",
-        "search_doc": "Искать документы",
-        "give_doc": "📄 Отдать документы",
-        "to_sidr": "К Сидоровичу"
-    }
+# Хранилище открывается при запуске (open_storage), а не при импорте модуля:
+# benchmark.py и replay.py подставляют свое и не трогают рабочую базу
+storage: Optional[AsyncStorage] = None
+profiler = SamplingProfiler(PROFILE_SAMPLE_RATE, PROFILE_SLOW_THRESHOLD, PROFILE_DIR, PROFILE_DUMP_INTERVAL)
+tracer = TraceRecorder(TRACE_FILE)
+
+# Действия-переходы по меню: при EDIT_MESSAGES они перерисовывают сообщение с кнопками,
+# а не присылают новое. Сюжетные действия всегда присылают новое сообщение
+NAVIGATION_ACTIONS = frozenset({"menu", "inventory", "stats", "quests", "help", "main", "back", "shop"})
+
+# Что сейчас показано в последнем сообщении бота: chat_id -> (message_id, текст, клавиатура)
+RENDERED_CACHE_SIZE = 10000
+rendered_messages = OrderedDict()
+
+
+def open_storage(backend: Optional[BaseStorage] = None) -> AsyncStorage:
+    global storage
+    if backend is None:
+        storage = AsyncStorage(create_storage(), workers=STORAGE_SHARDS)
+    else:
+        storage = AsyncStorage(backend)
+    return storage
+
+
+def remember_rendered(message, text: str, keyboard):
+    rendered_messages[message.chat_id] = (message.message_id, text, keyboard)
+    rendered_messages.move_to_end(message.chat_id)
+    if len(rendered_messages) > RENDERED_CACHE_SIZE:
+        rendered_messages.popitem(last=False)
+
 
-    for action in actions:
-        if action in action_map:
-            keyboard.append([InlineKeyboardButton(
-                action_map[action],
-                callback_data=f"action_{action}"
-            )])
-
-    # Кнопка меню
-    keyboard.append([InlineKeyboardButton(
-        "📱 Меню",
-        callback_data="action_menu"
-    )])
-
-    return InlineKeyboardMarkup(keyboard)
-
-
-def generate_menu_keyboard():
-    keyboard = [
-        [
-            InlineKeyboardButton("📦 Инвентарь", callback_data="action_inventory"),
-            InlineKeyboardButton("👤 Статистика", callback_data="action_stats"),
-        ],
-        [
-            InlineKeyboardButton("💼 Квесты", callback_data="action_quests"),
-            InlineKeyboardButton("❓ Помощь", callback_data="action_help"),
-        ] ,
-        [InlineKeyboardButton("🏠 На главную", callback_data="action_main")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+# При PERSISTENCE игрок уже загружен в context.user_data: хендлеры читают и меняют его в памяти,
+# а в хранилище изменения относит StoragePersistence. Без него - чтение и запись хранилища
+def create_persistence() -> StoragePersistence:
+    return StoragePersistence(storage, PERSISTENCE_INTERVAL)
+
+
+@asynccontextmanager
+async def player_session(user_id: str, context: ContextTypes.DEFAULT_TYPE):
+    if context.application.persistence:
+        async with storage.lock(user_id):
+            yield UserSession(storage.storage, user_id, context.user_data)
+    else:
+        async with storage.session(user_id) as session:
+            yield session
+
+
+async def get_player(user_id: str, context: ContextTypes.DEFAULT_TYPE) -> dict:
+    if context.application.persistence:
+        return context.user_data
+    return await storage.get_user(user_id)
+
+
+async def update_player(user_id: str, context: ContextTypes.DEFAULT_TYPE, updates: dict):
+    if context.application.persistence:
+        async with storage.lock(user_id):
+            BaseStorage._apply_updates(context.user_data, updates)
+    else:
+        await storage.update_user(user_id, updates)
 
 
 # Отправка нового сообщения вместо редактирования
 async def send_new_message(update: Update, text: str, keyboard=None, parse_mode="Markdown"):
-    if update.callback_query:
-        # Если это callback от кнопки
-        await update.callback_query.answer()
-        await update.callback_query.message.reply_text(
-            text=text,
-            reply_markup=keyboard,
-            parse_mode=parse_mode
-        )
-    elif update.message:
-        # Если это текстовое сообщение или команда
-        await update.message.reply_text(
-            text=text,
-            reply_markup=keyboard,
-            parse_mode=parse_mode
-        )
+    with metrics.timer("telegram_send_seconds", kind="new"):
+        if update.callback_query:
+            # Если это callback от кнопки
+            await update.callback_query.answer()
+            message = await update.callback_query.message.reply_text(
+                text=text,
+                reply_markup=keyboard,
+                parse_mode=parse_mode
+            )
+        elif update.message:
+            # Если это текстовое сообщение или команда
+            message = await update.message.reply_text(
+                text=text,
+                reply_markup=keyboard,
+                parse_mode=parse_mode
+            )
+        else:
+            return
+
+    if EDIT_MESSAGES:
+        remember_rendered(message, text, keyboard)
+
+
+# Перерисовка сообщения, на кнопку которого нажали. Если текст и клавиатура не изменились,
+# запрос к Telegram не отправляется вовсе; если изменилась только клавиатура - меняется только она
+async def edit_message(update: Update, text: str, keyboard=None, parse_mode="Markdown"):
+    with metrics.timer("telegram_send_seconds", kind="edit"):
+        await _edit_message(update, text, keyboard, parse_mode)
+
+
+async def _edit_message(update: Update, text: str, keyboard, parse_mode):
+    query = update.callback_query
+    message = query.message
+    await query.answer()
+
+    shown = rendered_messages.get(message.chat_id)
+    same_text = same_keyboard = False
+    if shown is not None and shown[0] == message.message_id:
+        same_text = shown[1] == text
+        same_keyboard = shown[2] == keyboard
+    if same_text and same_keyboard:
+        return
+
+    try:
+        if same_text:
+            await query.edit_message_reply_markup(reply_markup=keyboard)
+        else:
+            await query.edit_message_text(text=text, reply_markup=keyboard, parse_mode=parse_mode)
+    except BadRequest as error:
+        if "not modified" not in str(error):
+            # Сообщение удалено или слишком старое для редактирования
+            message = await message.reply_text(text=text, reply_markup=keyboard, parse_mode=parse_mode)
+    remember_rendered(message, text, keyboard)
 
 
-# Основной обработчик действий
+# Основной обработчик действий: находит обработчик по сцене и кнопке
 async def handle_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = str(query.from_user.id)
     action = query.data.replace("action_", "")
-    user_data = storage.get_user(user_id)
+    started = time.perf_counter()
 
-    response_text = ""
-    new_scene = user_data["current_scene"]
+    async with player_session(user_id, context) as session:
+        scene = session.data["current_scene"]
+        handler = dispatcher.resolve(scene, action)
+        result = await handler(update, session)
 
-    # Обработка меню и его подразделов
-    if action == "menu":
-        response_text = f"📱 *Меню игрока*\n\nВыбери раздел:"
-        await send_new_message(update, response_text, generate_menu_keyboard())
-        return
-
-    elif action == "inventory":
-        items = user_data.get("inventory", [])
-
-        if items:
-            item_list = []
-            for item_id in items:
-                item_info = GameEngine.ITEMS.get(item_id, {})
-                item_name = item_info.get("name", item_id)
-
-                if item_id == "key_x18":
-                    item_list.append(f"🔑 {item_name}")
-                elif item_id == "documents":
-                    item_list.append(f"📄 {item_name}")
-                elif item_id == "pistol":
-                    item_list.append(f"🔫 {item_name}")
-                elif item_id == "medkit":
-                    item_list.append(f"💊 {item_name}")
-                else:
-                    item_list.append(f"• {item_name}")
-
-            items_text = "\n".join(item_list)
-            response_text = f"📦 *Инвентарь {user_data['user_name']}:*\n\n{items_text}\n\n*Всего предметов:* {len(items)}"
-            keyboard_buttons = []
-
-            keyboard_buttons.append([
-                InlineKeyboardButton("🔙 Назад в меню", callback_data="action_menu"),
-                InlineKeyboardButton("🏠 На главную", callback_data="action_main"),
-            ])
-
-            await send_new_message(update, response_text, InlineKeyboardMarkup(keyboard_buttons))
+    # Обработчик возвращает (текст, клавиатура) или None, если уже ответил сам
+    if result is not None:
+        if EDIT_MESSAGES and action in NAVIGATION_ACTIONS:
+            await edit_message(update, *result)
         else:
-            response_text = "📦 *Инвентарь пуст*\n\nУ тебя пока нет предметов."
-            keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔙 Назад в меню", callback_data="action_menu"),
-            ]])
-            await send_new_message(update, response_text, keyboard)
-        return
+            await send_new_message(update, *result)
+
+    # Неизвестные действия пишутся одной серией, чтобы произвольный callback_data не плодил метки
+    label = action if dispatcher.has_handler(scene, action) else "unknown"
+    metrics.observe("bot_action_seconds", time.perf_counter() - started, action=label, scene=scene)
+
 
-    elif action == "stats":
-        health_status = "✅ Отличное" if user_data["health"] > 70 else \
-            "⚠️  Среднее" if user_data["health"] > 30 else \
-                "❌ Критическое"
+# Обработка меню и его подразделов
+@dispatcher.register("menu")
+async def action_menu(update: Update, session: UserSession):
+    response_text = f"📱 *Меню игрока*\n\nВыбери раздел:"
+    return response_text, MENU_KEYBOARD
+
+
+@dispatcher.register("inventory")
+async def action_inventory(update: Update, session: UserSession):
+    inventory = session.inventory
 
+    if inventory:
+        items_text = "\n".join(inventory.lines())
         response_text = (
-            f"👤 *Статистика игрока:*\n\n"
-            f"🔹 *Имя:* {user_data['user_name']}\n"
-            f"🔹 *Здоровье:* {user_data['health']}/100 {health_status}\n"
-            f"🔹 *Деньги:* {user_data['money']} руб.\n"
-            f"🔹 *Очки опыта:* {user_data['points']}\n"
-            f"🔹 *Текущая локация:* {user_data['current_scene']}\n"
-            f"🔹 *Предметов в инвентаре:* {len(user_data['inventory'])}\n"
+            f"📦 *Инвентарь {session.data['user_name']}:*\n\n{items_text}\n\n*Всего предметов:* {len(inventory)}"
         )
+        return response_text, INVENTORY_KEYBOARD
 
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("🔙 Назад в меню", callback_data="action_menu"),
-        ]])
+    response_text = "📦 *Инвентарь пуст*\n\nУ тебя пока нет предметов."
+    return response_text, BACK_TO_MENU_KEYBOARD
 
-        await send_new_message(update, response_text, keyboard)
-        return
 
-    elif action == "main":
-        response_text = GameEngine.get_scene_text(user_data["current_scene"], user_data["user_name"])
-        keyboard = generate_keyboard(user_data["current_scene"], user_data)
-        await send_new_message(update, response_text, keyboard)
-        return
+@dispatcher.register("stats")
+async def action_stats(update: Update, session: UserSession):
+    user_data = session.data
+    health_status = "✅ Отличное" if user_data["health"] > 70 else \
+        "⚠️  Среднее" if user_data["health"] > 30 else \
+            "❌ Критическое"
 
-    elif action == "quests":
-        response_text = f"📜 *Активные квесты:*\n\n"
+    response_text = (
+        f"👤 *Статистика игрока:*\n\n"
+        f"🔹 *Имя:* {user_data['user_name']}\n"
+        f"🔹 *Здоровье:* {user_data['health']}/100 {health_status}\n"
+        f"🔹 *Деньги:* {user_data['money']} руб.\n"
+        f"🔹 *Очки опыта:* {user_data['points']}\n"
+        f"🔹 *Текущая локация:* {user_data['current_scene']}\n"
+        f"🔹 *Предметов в инвентаре:* {len(session.inventory)}\n"
+    )
 
-        if "documents" not in user_data["inventory"]:
-            response_text += "✅ *Квест от Сидоровича:*\nНайти документы в лаборатории X18\n\n"
-        else:
-            response_text += "Пока нет активных квестов.\nПоговори с Сидоровичем для получения задания."
+    return response_text, BACK_TO_MENU_KEYBOARD
 
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("🔙 Назад в меню", callback_data="action_menu"),
-        ]])
 
-        await send_new_message(update, response_text, keyboard)
-        return
+# Неизвестное действие тоже возвращает игрока к текущей сцене
+@dispatcher.fallback
+@dispatcher.register("main")
+async def action_main(update: Update, session: UserSession):
+    user_data = session.data
+    response_text = GameEngine.get_scene_text(user_data["current_scene"], user_data["user_name"])
+    keyboard = generate_keyboard(user_data["current_scene"], user_data)
+    return response_text, keyboard
 
 
-    elif action == "help":
-        response_text = (
-            f"❓ *Помощь по игре*\n\n"
-            f"*Основные команды:*\n"
-            f"• Нажимай кнопки для взаимодействия\n"
-            f"• Используй Меню для доступа к статистики и инвентарю\n"
-            f"*Управление:*\n"
-            f"• /reset - перезапуск игры\n"
-            f"• /menu - открыть меню\n"
-        )
+@dispatcher.register("quests")
+async def action_quests(update: Update, session: UserSession):
+    response_text = f"📜 *Активные квесты:*\n\n"
 
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("🔙 Назад в меню", callback_data="action_menu"),
-        ]])
+    if "documents" not in session.inventory:
+        response_text += "✅ *Квест от Сидоровича:*\nНайти документы в лаборатории X18\n\n"
+    else:
+        response_text += "Пока нет активных квестов.\nПоговори с Сидоровичем для получения задания."
 
-        await send_new_message(update, response_text, keyboard)
-        return
+    return response_text, BACK_TO_MENU_KEYBOARD
 
 
+@dispatcher.register("help")
+async def action_help(update: Update, session: UserSession):
+    response_text = (
+        f"❓ *Помощь по игре*\n\n"
+        f"*Основные команды:*\n"
+        f"• Нажимай кнопки для взаимодействия\n"
+        f"• Используй Меню для доступа к статистики и инвентарю\n"
+        f"*Управление:*\n"
+        f"• /reset - перезапуск игры\n"
+        f"• /menu - открыть меню\n"
+    )
+
+    return response_text, BACK_TO_MENU_KEYBOARD
+
+
+# Переход в сцену с её текстом и кнопками
+def go_to_scene(session: UserSession, new_scene: str):
+    session.update({"current_scene": new_scene})
+    response_text = GameEngine.get_scene_text(new_scene, session.data["user_name"])
+    keyboard = generate_keyboard(new_scene, session.data)
+    return response_text, keyboard
+
+
+# Простые переходы между сценами описаны в контенте, для них хватает одного обработчика
+def make_transition(new_scene: str):
+    async def action_transition(update: Update, session: UserSession):
+        return go_to_scene(session, new_scene)
+    return action_transition
+
+
+for (scene_id, action), target in GameEngine.TRANSITIONS.items():
+    dispatcher.register(action, scene=scene_id)(make_transition(target))
 
-    # ОБРАБОТКА ОСНОВНЫХ ДЕЙСТВИЙ ИГРЫ
-    if action == "next" and user_data["current_scene"] == "sidorovich":
-        response_text = (
-            "Вдруг машина резко теряет управление, её носит из стороны в сторону\n"
-            "Она вылетает с дороги и переворачивается несколько раз ......\n"
-            "Вы теряете сознание......"
-        )
-        keyboard = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("Далее", callback_data="action_next1")]]
-        )
 
-    elif action == "next1" and user_data["current_scene"] == "sidorovich":
+# ОБРАБОТКА ОСНОВНЫХ ДЕЙСТВИЙ ИГРЫ
+@dispatcher.register("next", scene="sidorovich")
+async def action_next(update: Update, session: UserSession):
+    response_text = (
+        "Вдруг машина резко теряет управление, её носит из стороны в сторону\n"
+        "Она вылетает с дороги и переворачивается несколько раз ......\n"
+        "Вы теряете сознание......"
+    )
+    return response_text, CRASH_KEYBOARD
+
+
+@dispatcher.register("next1", scene="sidorovich")
+async def action_next1(update: Update, session: UserSession):
+    response_text = (
+        "Вы приходите в себя и не можете понять где вы оказались.\n"
+        "В каком-то помещении, вроде это подвал, да точно!\n"
+        "Напротив, за прилавком, сидит мужичок и смотрит на вас"
+    )
+    return response_text, WAKE_UP_KEYBOARD
+
+
+@dispatcher.register("next2", scene="sidorovich")
+async def action_next2(update: Update, session: UserSession):
+    response_text = GameEngine.get_scene_text("sidorovich", session.data['user_name'])
+    keyboard = generate_keyboard("sidorovich", session.data)
+    return response_text, keyboard
+
+
+@dispatcher.register("talk_stalker", scene="street")
+async def action_talk_stalker(update: Update, session: UserSession):
+    user_data = session.data
+    if not user_data.get("has_talked_stalker", False):
         response_text = (
-            "Вы приходите в себя и не можете понять где вы оказались.\n"
-            "В каком-то помещении, вроде это подвал, да точно!\n"
-            "Напротив, за прилавком, сидит мужичок и смотрит на вас"
-        )
-        keyboard = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("Что происходит?", callback_data="action_next2")]]
+            f"Сталкер хрипло кашляет и смотрит на тебя, {user_data['user_name']}:\n"
+            "Вижу, ты новенький. В лабораторию собрался?"
+            "Там жутко. Если пойдешь без пушки, то пиши пропало. \n"
+            "Пистолет можешь купить у Сидоровича'"
         )
+        session.update({"has_talked_stalker": True, "points": user_data["points"] + 10})
+    else:
+        response_text = f"Сталкер больше не хочет с тобой разговаривать, он устал и не в настроении"
 
-    elif action == "next2" and user_data["current_scene"] == "sidorovich":
-        response_text = GameEngine.get_scene_text("sidorovich", user_data['user_name'])
-        keyboard = generate_keyboard("sidorovich", storage.get_user(user_id))
+    keyboard = generate_keyboard(user_data["current_scene"], user_data)
+    return response_text, keyboard
 
 
-    elif action == "street" and user_data["current_scene"] == "sidorovich":
-        new_scene = "street"
-        storage.update_user(user_id, {"current_scene": new_scene})
-        response_text = GameEngine.get_scene_text(new_scene, user_data["user_name"])
-        keyboard = generate_keyboard(new_scene, user_data)
+@dispatcher.register("back")
+@dispatcher.register("to_sidr")
+async def action_back(update: Update, session: UserSession):
+    return go_to_scene(session, GameEngine.get_back_scene(session.data["current_scene"]))
 
-    elif action == "talk_stalker" and user_data["current_scene"] == "street":
-        if not user_data.get("has_talked_stalker", False):
-            response_text = (
-                f"Сталкер хрипло кашляет и смотрит на тебя, {user_data['user_name']}:\n"
-                "Вижу, ты новенький. В лабораторию собрался?"
-                "Там жутко. Если пойдешь без пушки, то пиши пропало. \n"
-                "Пистолет можешь купить у Сидоровича'"
-            )
-            storage.update_user(user_id, {"has_talked_stalker": True, "points": user_data["points"] + 10})
-        else:
-            response_text = f"Сталкер больше не хочет с тобой разговаривать, он устал и не в настроении"
 
-        keyboard = generate_keyboard(user_data["current_scene"], user_data)
+@dispatcher.register("search", scene="house")
+async def action_search(update: Update, session: UserSession):
+    user_data = session.data
+    if not user_data.get("has_found_key", False):
+        session.add_item("key_x18")
+        session.update({"has_found_key": True, "points": user_data["points"] + 20})
+        response_text = (
+            "🔍 *Поиск в доме...*\n\n"
+            "В старом комоде, под грудой пожелтевших газет, "
+            "ты находишь ржавый ключ с гравировкой 'X18'!\n\n"
+            "✅ *Ключ от лаборатории найден!*\n"
+            "*+ 20 очков опыта*"
+        )
+    else:
+        response_text = "Больше ничего интересного нет."
 
-    elif action == "back" or action == "to_sidr":
-        if user_data["current_scene"] == "street":
-            new_scene = "sidorovich"
-        elif user_data["current_scene"] == "house":
-            new_scene = "street"
-        elif user_data["current_scene"] == "lab_x18":
-            new_scene = "street"
-        elif user_data["current_scene"] == "lab_x18_in":
-            new_scene = "street"
-        elif user_data["current_scene"] == "shop":
-            new_scene = "sidorovich"
-        elif user_data["current_scene"] == "room":
-            new_scene = "lab_x18_in"
-        elif user_data["current_scene"] == "end":
-            new_scene = "sidorovich"
-
-        storage.update_user(user_id, {"current_scene": new_scene})
-        response_text = GameEngine.get_scene_text(new_scene, user_data["user_name"])
-        keyboard = generate_keyboard(new_scene, user_data)
-
-    elif action == "search_house" and user_data["current_scene"] == "street":
-        new_scene = "house"
-        storage.update_user(user_id, {"current_scene": new_scene})
-        response_text = GameEngine.get_scene_text(new_scene, user_data["user_name"])
-        keyboard = generate_keyboard(new_scene, user_data)
-
-    elif action == "search" and user_data["current_scene"] == "house":
-        if not user_data.get("has_found_key", False):
-            storage.add_item(user_id, "key_x18")
-            storage.update_user(user_id, {"has_found_key": True, "points": user_data["points"] + 20})
-            response_text = (
-                "🔍 *Поиск в доме...*\n\n"
-                "В старом комоде, под грудой пожелтевших газет, "
-                "ты находишь ржавый ключ с гравировкой 'X18'!\n\n"
-                "✅ *Ключ от лаборатории найден!*\n"
-                "*+ 20 очков опыта*"
-            )
-        else:
-            response_text = "Больше ничего интересного нет."
+    keyboard = generate_keyboard(user_data["current_scene"], user_data)
+    return response_text, keyboard
 
-        keyboard = generate_keyboard(user_data["current_scene"], user_data)
 
-    elif action == "lab_x18" and user_data["current_scene"] == "street" and user_data["has_door_open"] == False:
-        new_scene = "lab_x18"
-        storage.update_user(user_id, {"current_scene": new_scene})
-        response_text = GameEngine.get_scene_text(new_scene, user_data["user_name"])
-        keyboard = generate_keyboard(new_scene, user_data)
-
-    elif action == "lab_x18" and user_data["current_scene"] == "street" and user_data["has_door_open"] == True:
-        new_scene = "lab_x18_in"
-        storage.update_user(user_id, {"current_scene": new_scene})
-        response_text = GameEngine.get_scene_text(new_scene, user_data["user_name"])
-        keyboard = generate_keyboard(new_scene, user_data)
-
-    elif action == "try_door" and user_data["current_scene"] == "lab_x18":
-        if "key_x18" in user_data["inventory"]:
-            response_text = (
-                "Ты пытаешься открыть дверь...\n\n"
-                "Дверь заперта на ключ.\n\n"
-                "💡 *У тебя есть ключ!* \n\n"
-            )
+@dispatcher.register("lab_x18", scene="street")
+async def action_lab_x18(update: Update, session: UserSession):
+    if session.data["has_door_open"]:
+        return go_to_scene(session, "lab_x18_in")
+    return go_to_scene(session, "lab_x18")
 
-            keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔑 Использовать ключ", callback_data="action_use_key")]])
-        else:
-            response_text = (
-                "Вы пытаетесь открыть дверь...\n\n"
-                "Дверь не поддаётся. Она заперта на массивный замок.\n\n"
-                "🔑 *Нужен ключ* - поищи его в заброшенном доме на улице."
-            )
-            keyboard = generate_keyboard(user_data["current_scene"], user_data)
 
+@dispatcher.register("try_door", scene="lab_x18")
+async def action_try_door(update: Update, session: UserSession):
+    user_data = session.data
+    if "key_x18" in session.inventory:
+        response_text = (
+            "Ты пытаешься открыть дверь...\n\n"
+            "Дверь заперта на ключ.\n\n"
+            "💡 *У тебя есть ключ!* \n\n"
+        )
 
-    elif action == "use_key" and user_data["current_scene"] == "lab_x18":
+        keyboard = USE_KEY_KEYBOARD
+    else:
         response_text = (
-            "*Ключ подошёл!*\n"
-            "*+20 опыта*\n\n"
-            "Старая дверь со скрипом открывается...\n\n"
+            "Вы пытаетесь открыть дверь...\n\n"
+            "Дверь не поддаётся. Она заперта на массивный замок.\n\n"
+            "🔑 *Нужен ключ* - поищи его в заброшенном доме на улице."
         )
-        storage.update_user(user_id, {"has_door_open": True, "points": user_data["points"] + 20})
-        storage.update_user(user_id, { "inventory": [item for item in user_data["inventory"] if item != "key_x18"]})
-        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Войти", callback_data="action_lab_x18_in")]])
-
-    elif action == "lab_x18_in" and user_data["current_scene"] == "lab_x18":
-            user_data = storage.get_user(user_id)
-            new_scene = "lab_x18_in"
-            storage.update_user(user_id, {"current_scene": new_scene})
-            response_text = GameEngine.get_scene_text(new_scene, user_data["user_name"])
-            keyboard = generate_keyboard(new_scene, user_data)
-
-    elif action == "go_room" and user_data["current_scene"] == "lab_x18_in":
-        if user_data["has_killed"] == False:
-            response_text = (
-             "Вы идете вдоль по коридору\n"
-             "Подходите к комнате, хотите зайти, *как вдруг из неё выпрыгивает монстр и бросается на вас!!!!*"
-            )
-            if "pistol" in user_data["inventory"]:
-                keyboard = InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("СТРЕЛЯТЬ!", callback_data="action_shoot")]]
-                )
-            else:
-                await send_new_message(update, "*YOU DIED*\n\n"
-                    "Это было очень смело идти без оружия сюда.\n"
-                    "Чтобы начать игру заново напишите /reset", None)
-        else:
-            new_scene = "room"
-            storage.update_user(user_id, {"current_scene": new_scene})
-            response_text = (
-                "В этот раз вы зашли в комнату без происшествий\n\n"
-                "На столе стоит сейф"
-            )
-            keyboard = generate_keyboard(new_scene, user_data)
+        keyboard = generate_keyboard(user_data["current_scene"], user_data)
+    return response_text, keyboard
+
 
-    elif action == "shoot" and user_data["current_scene"] == "lab_x18_in":
+@dispatcher.register("use_key", scene="lab_x18")
+async def action_use_key(update: Update, session: UserSession):
+    response_text = (
+        "*Ключ подошёл!*\n"
+        "*+20 опыта*\n\n"
+        "Старая дверь со скрипом открывается...\n\n"
+    )
+    session.update({"has_door_open": True, "points": session.data["points"] + 20})
+    session.remove_item("key_x18")
+    return response_text, ENTER_LAB_KEYBOARD
+
+
+@dispatcher.register("go_room", scene="lab_x18_in")
+async def action_go_room(update: Update, session: UserSession):
+    user_data = session.data
+    if user_data["has_killed"]:
         new_scene = "room"
-        storage.update_user(user_id, {"current_scene": new_scene})
+        session.update({"current_scene": new_scene})
         response_text = (
-            "*ВЫСТРЕЛ*\n\n"
-            "Вы чудом успели нажать на курок и выжили\n"
-            "+100 очков опыта\n\n"
-            "Зайдя в комнату, вы обнаруживаете сейф на столе, "
-            "скорее всего в нем те документы, которые нужны Сидоровичу"
-        )
-        storage.update_user(user_id, {"has_killed": True, "points": user_data["points"] + 100})
-        keyboard = generate_keyboard(new_scene, user_data)
-
-    elif action == "search_doc" and user_data["current_scene"] == "room":
-        if not user_data.get("has_found_doc", False):
-            storage.add_item(user_id, "documents")
-            storage.update_user(user_id, {"has_found_doc": True, "points": user_data["points"] + 200})
-            response_text = (
-                "🔍 *Открытие сейфа...*\n\n"
-                "Сейф оказался закрыт не до конца, приоткрыв дверцу  "
-                "вы находите заветные документы для Сидоровича!\n\n"
-                "✅ *Документы найдены!*\n"
-                "*+ 200 очков опыта*"
-            )
-        else:
-            response_text = (
-                "В сейфе больше ничего нет!"
-            )
-        keyboard = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("🔙 Назад", callback_data="action_back")]]
+            "В этот раз вы зашли в комнату без происшествий\n\n"
+            "На столе стоит сейф"
         )
+        return response_text, generate_keyboard(new_scene, user_data)
+
+    if "pistol" not in session.inventory:
+        await send_new_message(update, "*YOU DIED*\n\n"
+            "Это было очень смело идти без оружия сюда.\n"
+            "Чтобы начать игру заново напишите /reset", None)
+        return None
+
+    response_text = (
+     "Вы идете вдоль по коридору\n"
+     "Подходите к комнате, хотите зайти, *как вдруг из неё выпрыгивает монстр и бросается на вас!!!!*"
+    )
+    return response_text, SHOOT_KEYBOARD
+
 
+@dispatcher.register("shoot", scene="lab_x18_in")
+async def action_shoot(update: Update, session: UserSession):
+    new_scene = "room"
+    session.update({"current_scene": new_scene})
+    response_text = (
+        "*ВЫСТРЕЛ*\n\n"
+        "Вы чудом успели нажать на курок и выжили\n"
+        "+100 очков опыта\n\n"
+        "Зайдя в комнату, вы обнаруживаете сейф на столе, "
+        "скорее всего в нем те документы, которые нужны Сидоровичу"
+    )
+    session.update({"has_killed": True, "points": session.data["points"] + 100})
+    keyboard = generate_keyboard(new_scene, session.data)
+    return response_text, keyboard
 
 
-    elif action == "shop" and user_data["current_scene"] == "sidorovich":
+@dispatcher.register("search_doc", scene="room")
+async def action_search_doc(update: Update, session: UserSession):
+    user_data = session.data
+    if not user_data.get("has_found_doc", False):
+        session.add_item("documents")
+        session.update({"has_found_doc": True, "points": user_data["points"] + 200})
         response_text = (
-            "📋 *Товары Сидоровича:*\n\n"
-            f"Пистолет ПМ - {GameEngine.SIDOROVICH_SHOP['pistol']} руб.\n\n"
-            f"Ваш баланс: {user_data['money']} руб."
+            "🔍 *Открытие сейфа...*\n\n"
+            "Сейф оказался закрыт не до конца, приоткрыв дверцу  "
+            "вы находите заветные документы для Сидоровича!\n\n"
+            "✅ *Документы найдены!*\n"
+            "*+ 200 очков опыта*"
         )
-        keyboard = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("Купить пистолет", callback_data="action_buy_gun")], [InlineKeyboardButton("🔙 Назад", callback_data="action_back"),]]
+    else:
+        response_text = (
+            "В сейфе больше ничего нет!"
         )
+    return response_text, BACK_KEYBOARD
 
 
-    elif action == "buy_gun" and user_data["current_scene"] == "sidorovich":
-        price = GameEngine.SIDOROVICH_SHOP["pistol"]
-        if user_data["money"] >= price:
-            storage.add_item(user_id, "pistol")
-            storage.update_user(user_id, {
-                "money": user_data["money"] - price,
-                "points": user_data["points"] + 5
-            })
-            response_text = (
-                f"✅ Ты купил пистолет ПМ за {price} рублей!\n"
-                f"💵 Осталось: {user_data['money'] - price} рублей\n\n"
-                f"Теперь ты лучше вооружён для похода в лабораторию."
-            )
-        else:
-            response_text =(
-                f"❌ Недостаточно денег! Нужно {price} рублей, а у тебя только {user_data['money']}.\n\n"
-                f"Выполни квест, чтобы получить больше денег."
-            )
-
-        keyboard = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("🔙 Назад", callback_data="action_back")]]
+@dispatcher.register("shop", scene="sidorovich")
+async def action_shop(update: Update, session: UserSession):
+    response_text = (
+        "📋 *Товары Сидоровича:*\n\n"
+        f"Пистолет ПМ - {GameEngine.SIDOROVICH_SHOP['pistol']} руб.\n\n"
+        f"Ваш баланс: {session.data['money']} руб."
+    )
+    return response_text, SHOP_KEYBOARD
+
+
+@dispatcher.register("buy_gun", scene=("sidorovich", "shop"))
+async def action_buy_gun(update: Update, session: UserSession):
+    user_data = session.data
+    price = GameEngine.SIDOROVICH_SHOP["pistol"]
+    if user_data["money"] >= price:
+        money_left = user_data["money"] - price
+        session.add_item("pistol")
+        session.update({
+            "money": money_left,
+            "points": user_data["points"] + 5
+        })
+        response_text = (
+            f"✅ Ты купил пистолет ПМ за {price} рублей!\n"
+            f"💵 Осталось: {money_left} рублей\n\n"
+            f"Теперь ты лучше вооружён для похода в лабораторию."
+        )
+    else:
+        response_text =(
+            f"❌ Недостаточно денег! Нужно {price} рублей, а у тебя только {user_data['money']}.\n\n"
+            f"Выполни квест, чтобы получить больше денег."
         )
-    elif action == "give_doc" and user_data["current_scene"] == "sidorovich":
-        new_scene = "end"
-        storage.update_user(user_id, {"current_scene": new_scene})
-
-        if "documents" in user_data["inventory"]:
-            response_text = (
-                f"Спасибо, {user_data["user_name"]}, вот тебе награда от меня\n\n"
-                f"+2000рублей\n"
-                f"+500 очков опыта\n\n"
-                f"Поздравляем, вы прошли игру!!!\n"
-                f"Если хотите, то продолжить изучение локаций"
-            )
-        else:
-            response_text = ("Когда будут документы, тогда и приходи\n"
-                             "Нечего просто так беспокоить"
-            )
-        keyboard = generate_keyboard(new_scene, user_data)
 
+    return response_text, BACK_KEYBOARD
 
 
+@dispatcher.register("give_doc", scene="sidorovich")
+async def action_give_doc(update: Update, session: UserSession):
+    user_data = session.data
+    new_scene = "end"
+    session.update({"current_scene": new_scene})
 
+    if "documents" in session.inventory:
+        response_text = (
+            f"Спасибо, {user_data["user_name"]}, вот тебе награда от меня\n\n"
+            f"+2000рублей\n"
+            f"+500 очков опыта\n\n"
+            f"Поздравляем, вы прошли игру!!!\n"
+            f"Если хотите, то продолжить изучение локаций"
+        )
     else:
-        # Если действие не распознано, показываем текущую сцену
-        response_text = GameEngine.get_scene_text(user_data["current_scene"], user_data["user_name"])
-        keyboard = generate_keyboard(user_data["current_scene"], user_data)
-
-    await send_new_message(update, response_text, keyboard)
+        response_text = ("Когда будут документы, тогда и приходи\n"
+                         "Нечего просто так беспокоить"
+        )
+    keyboard = generate_keyboard(new_scene, user_data)
+    return response_text, keyboard
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -479,7 +529,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "has_found_doc": False,
     }
 
-    storage.update_user(user_id, user_data)
+    await update_player(user_id, context, user_data)
 
     response_text = GameEngine.get_scene_text("start", "")
 
@@ -494,7 +544,7 @@ async def reset_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
 
     # Полностью сбрасываем данные
-    storage.update_user(user_id, {
+    await update_player(user_id, context, {
         "user_id": user_id,
         "user_name": "",
         "current_scene": "start",
@@ -520,20 +570,22 @@ async def reset_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     text = update.message.text.strip()
-    user_data = storage.get_user(user_id)
 
-    if user_data["current_scene"] == "start":
-        # Это ввод имени
-        await handle_name(update, text, user_data)
-    else:
-        await handle_game_text(update, text, user_data)
+    with metrics.timer("bot_text_seconds"):
+        user_data = await get_player(user_id, context)
+
+        if user_data["current_scene"] == "start":
+            # Это ввод имени
+            await handle_name(update, context)
+        else:
+            await handle_game_text(update, text, user_data)
 
 # Обработка имени пользователя
 async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     user_name = update.message.text.strip()
 
-    storage.update_user(user_id, {
+    await update_player(user_id, context, {
         "user_name": user_name,
         "current_scene": "sidorovich"
     })
@@ -543,10 +595,7 @@ async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Гремит гром, сверкает молния. Вокруг только лес и поля Чернобыльской зоны отчуждения\n"
         "Вдруг внезапно в вашу машину попадает молния"
     )
-    keyboard = InlineKeyboardMarkup(
-        [[InlineKeyboardButton("Далее", callback_data="action_next")]]
-    )
-    await update.message.reply_text(response_text, reply_markup=keyboard, parse_mode="Markdown")
+    await update.message.reply_text(response_text, reply_markup=INTRO_KEYBOARD, parse_mode="Markdown")
 
 
 async def handle_game_text(update: Update, text: str, user_data: dict):
@@ -560,17 +609,11 @@ async def handle_game_text(update: Update, text: str, user_data: dict):
 # Команда инвентаря
 async def inventory_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    user_data = storage.get_user(user_id)
-
-    items = user_data.get("inventory", [])
+    user_data = await get_player(user_id, context)
+    inventory = Inventory(user_data.get("inventory", ()))
 
-    if items:
-        item_names = []
-        for item_id in items:
-            item_info = GameEngine.ITEMS.get(item_id, {})
-            item_names.append(f"• {item_info.get('name', item_id)}")
-
-        items_text = "\n".join(item_names)
+    if inventory:
+        items_text = "\n".join(inventory.lines())
         response_text = f"📦 *Инвентарь:*\n\n{items_text}"
     else:
         response_text = "📦 *Инвентарь пуст*"
@@ -581,24 +624,24 @@ async def inventory_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Команда меню
 async def menu_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     response_text = f"📱 *Меню игрока*\n\nВыбери раздел:"
-    keyboard = generate_menu_keyboard()
+    keyboard = MENU_KEYBOARD
     await update.message.reply_text(response_text, reply_markup=keyboard, parse_mode="Markdown")
 
 
 async def debug_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    user_data = storage.get_user(user_id)
+    state = PlayerState.from_dict(await get_player(user_id, context))
 
     response_text = (
         f"🔧 *Отладка состояния:*\n\n"
         f"ID: {user_id}\n"
-        f"Имя: {user_data['user_name']}\n"
-        f"Сцена: {user_data['current_scene']}\n"
-        f"Инвентарь: {user_data['inventory']}\n"
-        f"Деньги: {user_data['money']}\n"
-        f"Здоровье: {user_data['health']}\n"
-        f"Ключ найден: {user_data.get('has_found_key', False)}\n"
-        f"Говорил со сталкером: {user_data.get('has_talked_stalker', False)}"
+        f"Имя: {state.user_name}\n"
+        f"Сцена: {state.current_scene}\n"
+        f"Инвентарь: {state.items()}\n"
+        f"Деньги: {state.money}\n"
+        f"Здоровье: {state.health}\n"
+        f"Ключ найден: {state.has_flag('has_found_key')}\n"
+        f"Говорил со сталкером: {state.has_flag('has_talked_stalker')}"
     )
 
     await update.message.reply_text(response_text, parse_mode="Markdown")
@@ -606,17 +649,18 @@ async def debug_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def to_sidorovich(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    user_data = storage.get_user(user_id)
 
-    if not user_data["user_name"]:
-        await update.message.reply_text(
-            "Сначала введи своё имя в чат.",
-            parse_mode="Markdown"
-        )
-        return
+    async with player_session(user_id, context) as session:
+        user_data = session.data
+
+        if not user_data["user_name"]:
+            await update.message.reply_text(
+                "Сначала введи своё имя в чат.",
+                parse_mode="Markdown"
+            )
+            return
 
-    storage.update_user(user_id, {"current_scene": "sidorovich"})
-    user_data = storage.get_user(user_id)
+        session.update({"current_scene": "sidorovich"})
 
     response_text = GameEngine.get_scene_text("sidorovich", user_data["user_name"])
     keyboard = generate_keyboard("sidorovich", user_data)
@@ -628,13 +672,99 @@ async def to_sidorovich(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-def main():
-    application = Application.builder().token(TOKEN).build()
+# Живые задержки для администраторов: p50 / p99 в миллисекундах и число замеров
+async def metrics_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    lines = ["📈 Задержки, мс (p50 / p99, замеров)"]
+    for name, title in (
+        ("bot_action_seconds", "Кнопки"),
+        ("bot_text_seconds", "Текст"),
+        ("telegram_send_seconds", "Отправка"),
+        ("storage_call_seconds", "Хранилище"),
+    ):
+        rows = metrics.percentiles(name)
+        if not rows:
+            continue
+        lines.append(f"\n{title}:")
+        for labels, count, p50, p99 in rows[:10]:
+            label = " / ".join(str(value) for value in labels.values()) or "всего"
+            lines.append(f"{label}: {p50 * 1000:.1f} / {p99 * 1000:.1f} ({count})")
+
+    requests = metrics.total("telegram_rate_limit_requests_total")
+    if requests:
+        lines.append(
+            f"\n🚦 Ограничение отправки: запросов {requests:g}, "
+            f"задержано {metrics.total('telegram_rate_limit_delayed_total'):g} "
+            f"(всего {metrics.total('telegram_rate_limit_wait_seconds_total'):.1f} с), "
+            f"429: {metrics.total('telegram_rate_limit_retry_after_total'):g}, "
+            f"не отправлено: {metrics.total('telegram_rate_limit_failed_total'):g}"
+        )
+
+    # Без Markdown: в названиях действий есть подчеркивания
+    await update.message.reply_text("\n".join(lines))
+
+
+# Профилирование на лету: /profile [on <доля> | slow <секунды> | off | dump | reset]
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    args = context.args or []
+    command = args[0] if args else ""
+    try:
+        if command == "on":
+            profiler.sample_rate = float(args[1]) if len(args) > 1 else 0.01
+        elif command == "slow":
+            profiler.slow_threshold = float(args[1]) if len(args) > 1 else 0.5
+        elif command == "off":
+            profiler.sample_rate = 0.0
+            profiler.slow_threshold = 0.0
+        elif command == "reset":
+            profiler.reset()
+    except ValueError:
+        await update.message.reply_text("Использование: /profile [on <доля> | slow <секунды> | off | dump | reset]")
+        return
+
+    if command == "dump":
+        paths = profiler.dump()
+        await update.message.reply_text("\n".join(paths) or "Профилей пока нет")
+        return
+
+    state = "включено" if profiler.enabled else "выключено"
+    collected = ", ".join(f"{name}: {count}" for name, count in profiler.profiled.items()) or "ничего"
+    await update.message.reply_text(
+        f"Профилирование {state}: доля {profiler.sample_rate}, порог {profiler.slow_threshold} с\n"
+        f"Собрано профилей: {collected}"
+    )
+
+
+metrics_task = None
+
 
+async def on_startup(application: Application):
+    global metrics_task
+    if METRICS_LOG_INTERVAL:
+        metrics_task = asyncio.create_task(log_periodically(METRICS_LOG_INTERVAL))
+
+
+async def on_shutdown(application: Application):
+    if metrics_task is not None:
+        metrics_task.cancel()
+    if profiler.profiled:
+        profiler.dump()
+    tracer.close()
+    # Сбрасываем на диск всё, что ещё не записано
+    await storage.close()
+
+
+def register_handlers(application: Application):
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("reset", reset_game))
 
     application.add_handler(CommandHandler("debug", debug_state))
+    application.add_handler(CommandHandler("metrics", metrics_cmd))
     application.add_handler(CommandHandler("sidorovich", to_sidorovich))
     application.add_handler(CommandHandler("inventory", inventory_cmd))
     application.add_handler(CommandHandler("menu", menu_cmd))
@@ -644,7 +774,44 @@ def main():
 
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Профилировщик оборачивает все хендлеры; пока он выключен, обертка ничего не делает
+    application.add_handler(CommandHandler("profile", profile_cmd))
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = profiler.wrap(handler.callback)
+
+    # Трасса для replay.py пишется раньше всех хендлеров (группа -1) и не профилируется
+    if tracer.enabled:
+        application.add_handler(TypeHandler(Update, tracer.record), group=-1)
+
+
+def main():
+    GameEngine.validate(dispatcher.has_handler)
+    open_storage()
+
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .rate_limiter(create_rate_limiter())
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if PERSISTENCE:
+        builder = builder.persistence(create_persistence())
+
+    if WEBHOOK_URL:
+        application = builder.updater(None).build()
+        register_handlers(application)
+        asyncio.run(run_webhook(
+            application, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+            WEBHOOK_SECRET, allowed_updates=ALLOWED_UPDATES, metrics_path=METRICS_PATH
+        ))
+    else:
+        application = builder.build()
+        register_handlers(application)
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Dict, List
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from config import (
+    TOKEN, CONCURRENT_UPDATES, STORAGE_SHARDS, UPDATE_QUEUE_SIZE,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+)
+from rate_limiter import create_rate_limiter
+from sharding import ShardedStorage
+from webhook import ALLOWED_UPDATES, run_webhook
+
+# Несколько процессов-обработчиков на одной машине. Входной процесс получает апдейты
+# (опросом или вебхуком) и раскладывает их по очередям воркеров по шарду игрока:
+# шард s обслуживает воркер s % workers. Апдейты одного игрока всегда попадают в один
+# процесс и в одну очередь, поэтому идут по порядку, а разные игроки обрабатываются
+# параллельно. Каждый воркер открывает только свои шарды хранилища.
+# python cluster.py --workers 4   (STORAGE_SHARDS в config.py должно делиться на 4)
+
+logger = logging.getLogger(__name__)
+
+
+def owned_shards(worker: int, workers: int, shards: int) -> List[int]:
+    return [index for index in range(shards) if index % workers == worker]
+
+
+def update_user_id(data: Dict[str, Any]):
+    for kind in ALLOWED_UPDATES:
+        if kind in data:
+            return data[kind].get("from", {}).get("id")
+    return None
+
+
+class UpdateRouter:
+    def __init__(self, queues: List[multiprocessing.Queue], shards: int):
+        self.queues = queues
+        self.shards = shards
+
+    def worker_index(self, data: Dict[str, Any]) -> int:
+        user_id = update_user_id(data)
+        if user_id is None:
+            return 0
+        return ShardedStorage.shard_index(str(user_id), self.shards) % len(self.queues)
+
+    # Входное приложение обрабатывает апдейты по одному, так что порядок в очередях сохраняется
+    async def route(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        data = update.to_dict()
+        target = self.queues[self.worker_index(data)]
+        try:
+            target.put_nowait(data)
+        except queue.Full:
+            # Воркер не успевает: ждем места, не блокируя цикл событий
+            await asyncio.to_thread(target.put, data)
+
+
+def run_worker(worker: int, workers: int, updates: multiprocessing.Queue, shared_pause,
+               offline: bool = False):
+    # Ctrl+C получает вся группа процессов; воркер завершается по сигналу от входного процесса
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import config
+    config.STORAGE_OWNED_SHARDS = owned_shards(worker, workers, config.STORAGE_SHARDS)
+    logger.info("Воркер %s обслуживает шарды %s", worker, config.STORAGE_OWNED_SHARDS)
+    asyncio.run(_serve_worker(updates, workers, shared_pause, offline))
+
+
+# Лимиты Telegram действуют на бота целиком: каждый воркер получает долю общего лимита,
+# а паузу после 429 воркеры делят через shared_pause
+async def _serve_worker(updates: multiprocessing.Queue, workers: int, shared_pause, offline: bool):
+    # bot импортируется только здесь, когда config уже знает шарды этого воркера
+    import bot
+    from dispatcher import dispatcher
+    from game_engine import GameEngine
+
+    GameEngine.validate(dispatcher.has_handler)
+    bot.open_storage()
+
+    builder = (
+        Application.builder()
+        .updater(None)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+    )
+    rate_limiter = create_rate_limiter(workers, shared_pause)
+    if offline:
+        from fake_telegram import create_fake_bot
+        fake_bot, _ = await create_fake_bot(rate_limiter)
+        builder = builder.bot(fake_bot)
+    else:
+        builder = builder.token(TOKEN).rate_limiter(rate_limiter)
+    if bot.PERSISTENCE:
+        builder = builder.persistence(bot.create_persistence())
+    application = builder.build()
+    bot.register_handlers(application)
+
+    loop = asyncio.get_running_loop()
+    async with application:
+        await application.start()
+        await bot.on_startup(application)
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        await application.stop()
+    await bot.on_shutdown(application)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах")
+    parser.add_argument("--workers", type=int, default=STORAGE_SHARDS, help="сколько процессов-обработчиков")
+    parser.add_argument("--offline", action="store_true",
+                        help="поддельный Bot API и локальный вебхук для проверки без сети")
+    parser.add_argument("--port", type=int, default=8080, help="порт локального вебхука для --offline")
+    args = parser.parse_args()
+
+    if STORAGE_SHARDS % args.workers:
+        parser.error(f"STORAGE_SHARDS = {STORAGE_SHARDS} не делится на {args.workers} воркеров: "
+                     f"два процесса писали бы в один файл")
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(maxsize=UPDATE_QUEUE_SIZE) for _ in range(args.workers)]
+    shared_pause = context.Value("d", 0.0)
+    processes = [
+        context.Process(target=run_worker,
+                        args=(worker, args.workers, queues[worker], shared_pause, args.offline),
+                        name=f"worker-{worker}")
+        for worker in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    router = UpdateRouter(queues, STORAGE_SHARDS)
+    try:
+        if args.offline:
+            asyncio.run(_run_offline_front(router, args.port))
+        else:
+            builder = Application.builder().token(TOKEN)
+            if WEBHOOK_URL:
+                application = builder.updater(None).build()
+                application.add_handler(TypeHandler(Update, router.route))
+                asyncio.run(run_webhook(
+                    application, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, allowed_updates=ALLOWED_UPDATES
+                ))
+            else:
+                application = builder.build()
+                application.add_handler(TypeHandler(Update, router.route))
+                application.run_polling(allowed_updates=ALLOWED_UPDATES)
+    finally:
+        for updates in queues:
+            updates.put(None)
+        for process in processes:
+            process.join()
+
+
+async def _run_offline_front(router: UpdateRouter, port: int):
+    from fake_telegram import create_fake_bot
+
+    fake_bot, _ = await create_fake_bot()
+    application = Application.builder().bot(fake_bot).updater(None).build()
+    application.add_handler(TypeHandler(Update, router.route))
+    await run_webhook(application, "", "127.0.0.1", port, WEBHOOK_PATH)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    main()
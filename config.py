@@ -1,2 +1,68 @@
 TOKEN = "...." #Здесь должен быть токен вашего бота
-JSON_FILE = "data/users.json"
\ No newline at end of file
+# Сцены, переходы, предметы и цены игры
+CONTENT_FILE = "data/content.json"
+# Где хранить игроков: "json" (один файл JSON_FILE), "journal" (JSON_FILE + журнал изменений)
+# или "sqlite" (база SQLITE_FILE)
+STORAGE_BACKEND = "json"
+JSON_FILE = "data/users.json"
+SQLITE_FILE = "data/users.db"
+# На сколько шардов (отдельных файлов/баз) делить игроков и какие шарды обслуживает этот процесс
+# (None - все). Сменить число шардов: python sharding.py <было> <стало>
+STORAGE_SHARDS = 1
+STORAGE_OWNED_SHARDS = None
+# Хранить игроков в JSON компактными записями без имен полей (меньше памяти и размер файла)
+COMPACT_USERS = False
+# Как часто (в секундах) журнал сворачивается в снимок JSON_FILE и куда складывать старые журналы
+JOURNAL_COMPACT_INTERVAL = 300
+JOURNAL_ARCHIVE_DIR = "data/journal"
+# Как часто (в секундах) накопленные изменения игроков сбрасываются на диск
+FLUSH_INTERVAL = 5
+# Холодное хранилище: игроки, не заходившие COLD_AFTER секунд, и самые давние сверх MAX_HOT_USERS
+# уходят из основного хранилища в сжатые файлы COLD_DIR и возвращаются при следующем заходе
+# (0 - без ограничения; оба 0 - всё в основном хранилище). Проверка раз в EVICT_INTERVAL секунд
+COLD_AFTER = 0
+MAX_HOT_USERS = 0
+COLD_DIR = "data/cold"
+EVICT_INTERVAL = 60
+# Сколько апдейтов разных игроков обрабатывать одновременно (апдейты одного игрока защищены блокировкой)
+CONCURRENT_UPDATES = 64
+# Держать игроков в памяти (context.user_data) и записывать их изменения в хранилище раз
+# в PERSISTENCE_INTERVAL секунд, а не читать и писать хранилище на каждый апдейт.
+# При падении процесса теряются изменения не больше чем за PERSISTENCE_INTERVAL
+PERSISTENCE = False
+PERSISTENCE_INTERVAL = 30
+# Вебхук вместо опроса: публичный адрес (пусто - run_polling), где слушать, путь и секрет,
+# который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = ""
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = ""
+# Сколько апдейтов может ждать обработки; при переполнении вебхук отвечает 503, а опрос ждет
+UPDATE_QUEUE_SIZE = 1000
+# Лимиты исходящих сообщений (в секундах): всего на бота, на личный чат (и сколько можно
+# отправить подряд), на группу; сколько раз повторять запрос после 429 Too Many Requests.
+# В cluster.py общий лимит делится поровну между воркерами
+RATE_LIMIT_GLOBAL = 30
+RATE_LIMIT_CHAT = 1
+RATE_LIMIT_CHAT_BURST = 3
+RATE_LIMIT_GROUP = 20 / 60
+RATE_LIMIT_MAX_RETRIES = 3
+# Переходы по меню ("Меню", "Инвентарь", "Назад"...) редактируют сообщение с кнопками вместо
+# отправки нового: меньше запросов к Telegram и короче история чата
+EDIT_MESSAGES = False
+# Telegram id администраторов: им доступна команда /metrics с задержками p50/p99
+ADMIN_IDS = []
+# Метрики в формате Prometheus: GET METRICS_PATH на порту вебхука и/или вывод в лог
+# каждые METRICS_LOG_INTERVAL секунд (0 - не выводить)
+METRICS_PATH = "/metrics"
+METRICS_LOG_INTERVAL = 0
+# Выборочное профилирование хендлеров (включается и командой /profile): доля апдейтов,
+# порог в секундах для медленных апдейтов (0 - выключено), куда и как часто писать профили
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_SLOW_THRESHOLD = 0.0
+PROFILE_DIR = "data/profiles"
+PROFILE_DUMP_INTERVAL = 60
+# Записывать входящие апдейты в JSONL-трассу для воспроизведения: python replay.py <файл>
+# (пусто - не записывать). В трассу попадают тексты и имена игроков
+TRACE_FILE = ""
@@ -0,0 +1,47 @@
+import logging
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Обработчик, который срабатывает в любой сцене (меню, "назад" и т.п.)
+ANY_SCENE = None
+
+
+# Таблица обработчиков кнопок: (сцена, действие) -> функция
+class ActionDispatcher:
+    def __init__(self):
+        self._handlers: Dict[Tuple[Optional[str], str], Callable] = {}
+        self._fallback: Optional[Callable] = None
+
+    def register(self, action: str, scene: Union[str, Iterable[str], None] = ANY_SCENE):
+        scenes = [scene] if scene is ANY_SCENE or isinstance(scene, str) else list(scene)
+
+        def decorator(handler: Callable) -> Callable:
+            for scene_id in scenes:
+                key = (scene_id, action)
+                if key in self._handlers:
+                    raise ValueError(f"Обработчик для {key} уже зарегистрирован")
+                self._handlers[key] = handler
+            return handler
+
+        return decorator
+
+    # Единственный путь для неизвестных сочетаний сцены и действия
+    def fallback(self, handler: Callable) -> Callable:
+        self._fallback = handler
+        return handler
+
+    def has_handler(self, scene: str, action: str) -> bool:
+        return (scene, action) in self._handlers or (ANY_SCENE, action) in self._handlers
+
+    def resolve(self, scene: str, action: str) -> Callable:
+        handler = self._handlers.get((scene, action))
+        if handler is None:
+            handler = self._handlers.get((ANY_SCENE, action))
+        if handler is None:
+            logger.info("Нет обработчика для действия %s в сцене %s", action, scene)
+            handler = self._fallback
+        return handler
+
+
+dispatcher = ActionDispatcher()
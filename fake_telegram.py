@@ -0,0 +1,114 @@
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.ext import BaseRateLimiter, ExtBot
+from telegram.request import BaseRequest, RequestData
+
+# Поддельный Bot API для бенчмарков и прогонов без сети: бот получает настоящие
+# объекты Update, а все запросы к Telegram отвечаются локально.
+# flood_every=N: каждый N-й запрос на отправку/редактирование отвечает 429 Too Many Requests;
+# keep_replies: запоминать тексты ответов по чатам (для сравнения прогонов в replay.py)
+
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "StalkerBot", "username": "stalker_bot"}
+SEND_METHODS = ("sendMessage", "editMessageText", "editMessageReplyMarkup")
+
+
+class FakeRequest(BaseRequest):
+    def __init__(self, flood_every: int = 0, retry_after: int = 1, keep_replies: bool = False):
+        self.calls = Counter()
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.replies: Optional[Dict[Any, List[str]]] = defaultdict(list) if keep_replies else None
+        self._message_id = 0
+        self._sends = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        if self.flood_every and api_method in SEND_METHODS:
+            self._sends += 1
+            if self._sends % self.flood_every == 0:
+                self.calls["429"] += 1
+                return 429, json.dumps({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }).encode("utf-8")
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode("utf-8")
+
+    def _result(self, api_method: str, params: Dict[str, Any]) -> Any:
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method in SEND_METHODS:
+            if self.replies is not None:
+                self.replies[params.get("chat_id")].append(params.get("text", ""))
+            self._message_id += 1
+            message = {
+                "message_id": params.get("message_id", self._message_id),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            if "reply_markup" in params:
+                message["reply_markup"] = params["reply_markup"]
+            return message
+        return True
+
+
+async def create_fake_bot(rate_limiter: BaseRateLimiter = None, flood_every: int = 0,
+                          keep_replies: bool = False) -> Tuple[ExtBot, FakeRequest]:
+    request = FakeRequest(flood_every, keep_replies=keep_replies)
+    bot = ExtBot(FAKE_TOKEN, request=request, get_updates_request=request, rate_limiter=rate_limiter)
+    await bot.initialize()
+    return bot, request
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"Player{user_id}"}
+
+
+def _message(message_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return message
+
+
+def make_message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    return {"update_id": update_id, "message": _message(update_id, user_id, text)}
+
+
+def make_callback_update(update_id: int, user_id: int, data: str) -> Dict[str, Any]:
+    message = _message(update_id, user_id, "")
+    message["from"] = BOT_USER
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "message": message,
+            "data": data,
+        },
+    }
@@ -1,110 +1,160 @@
+import functools
+import json
 import random
+import string
+from contextvars import ContextVar
 
+from config import CONTENT_FILE
 
+# Сколько отрисованных текстов (сцена, имя) держать в памяти
+SCENE_TEXT_CACHE_SIZE = 4096
+
+# Генератор для случайных вариантов текста. По умолчанию общий модуль random;
+# replay.py задает каждому апдейту свой генератор с фиксированным зерном
+scene_random: ContextVar = ContextVar("scene_random", default=random)
+
+
+# Текст сцены, разобранный при загрузке: готовая строка, шаблон с именем игрока
+# или набор заранее собранных вариантов
+class SceneText:
+    __slots__ = ("static", "template", "pool")
+
+    def __init__(self, text, greetings=None):
+        self.static = None
+        self.template = None
+        self.pool = ()
+
+        if greetings:
+            self.pool = tuple(text.format(greeting=greeting) for greeting in greetings)
+        elif any(field is not None for _, field, _, _ in string.Formatter().parse(text)):
+            self.template = text
+        else:
+            self.static = text.format()
+
+
+# Весь контент игры (сцены, переходы, предметы, цены) лежит в CONTENT_FILE.
+# Тексты сцен - шаблоны: {user_name} подставляется при показе,
+# сцены без подстановок отдаются готовой строкой
 class GameEngine:
-    SCENES = {
-        "start": {
-            "text": "Добро пожаловать в Зону, сталкер. Введи своё имя:",
-            "actions": []
-        },
-        "sidorovich": {
-            "text": lambda user_name: (
-                f" *Бункер Сидоровича*\n\n"
-                f""
-                f"Короче, Меченый, я тебя спас и в благородство играть не буду: выполнишь для меня пару заданий — и мы в расчете."
-                f" Заодно посмотрим, как быстро у тебя башка после амнезии прояснится. \n\n"
-                f"*Задание:*\n"
-                f"Нужно принести кое-какие документы из лаборатории x18, что тебя там ждет я не знаю.\n"
-                f"И вот что, будь осторожен\n\n"
-                f"*Принеси документы*"
-            ),
-            "actions": ["shop", "give_doc", "street"]
-        },
-        "street": {
-            "text": lambda user_name: (
-                f"🌫️ *Улицы Припяти*\n\n"
-                f"Вы вышли на улицу и оказались среди мёртвых домов. "
-                f"Ветер шепчет старые секреты. Напротив — заброшенный дом, "
-                f"где может быть ключ от лаборатории.\n\n"
-                f"Вы видите ещё одного сталкера, сидящего у костра\n\n"
-                f"*Куда пойдёшь?*"
-            ),
-            "actions": ["talk_stalker", "search_house", "lab_x18", "to_sidr"]
-        },
-        "house": {
-            "text": "🏚️ *Заброшенный дом*\n\nВы в старом доме. Пахнет плесенью и пылью. Старая мебель разбросана по комнатам.\n\n*Что будешь делать?*",
-            "actions": ["search", "back"]
-        },
-        "lab_x18": {
-            "text": lambda user_name: (
-                f"☢️ *Лаборатория X18*\n\n"
-                f"Перед вами массивной дверью лаборатории. "
-                f"На ней видны следы от пуль и царапины. "
-                f"Табличка 'X18' едва читается под слоем ржавчины.\n\n"
-            ),
-            "actions": ["try_door", "back"]
-        },
-        "lab_x18_in": {
-            "text": "Вы внутри лаборатории X18. Темно. В воздухе висит запах окисленного металла.  \n" 
-                "Послышался шорох, возможно где-то рядом мутант...\n"
-                "Ты увидел вдали комнату, в которой мерцает свет от ламп.\n"
-                "Там могут быть мутанты, а без оружия их не одолеть\n\n"
-                "*Решишься ли ты идти туда?*",
-            "actions": ["go_room", "back"]
-        },
-        "shop": {
-            "text": lambda user_name: (
-                f"*Магазин*\n\n"
-                f"'{random.choice([
-                    f'Ну! Чё стоишь? Подходи, не кусаюсь',
-                    f'Эй! Иди сюда, подкину тебе кое-чего!',
-                    f'Здарова, рад тебя видеть! Ну чё, давай о деле поговорим?'
-                ])}"
-            ),
-            "actions": ["buy", "back"]
-        },
-        "room": {
-            "text": "",
-            "actions": ["search_doc", "back"]
-        },
-
-        "end": {
-            "text": "",
-            "actions": ["menu", "back"]
-        }
+    SCENES = {}
+    ITEMS = {}
+    SIDOROVICH_SHOP = {}
+    # Подписи кнопок действий
+    ACTION_LABELS = {}
 
-    }
-
-    ITEMS = {
-        "key_x18": {
-            "name": "🔑 Ключ от X18",
-            "description": "Ржавый ключ с гравировкой 'X18'"
-        },
-        "pistol": {
-            "name": " Пистолет ПМ",
-            "description": "9-мм пистолет, не самый мощный, но лучше, чем ничего",
-            "price": 1000
-        },
-        "documents": {
-            "name": " Документы X18",
-            "description": "Запечатанная папка с грифом 'Совершенно секретно'"
+    # Индексы графа сцен, строятся load_content()
+    # (сцена, действие) -> сцена, куда ведет действие
+    TRANSITIONS = {}
+    # сцена -> куда ведет кнопка "Назад"
+    BACK_SCENES = {}
+    # сцена -> все сцены, куда из нее можно попасть
+    NEXT_SCENES = {}
+    # Короткие числовые коды предметов для компактного хранения: предмет <-> код
+    ITEM_CODES = {}
+    ITEMS_BY_CODE = {}
+    # Готовые строки предметов для инвентаря ("🔑 Ключ от X18") и предметы, которых бывает несколько штук
+    ITEM_TITLES = {}
+    STACKABLE_ITEMS = frozenset()
+
+    # Скомпилированные тексты сцен
+    SCENE_TEXTS = {}
+
+    @staticmethod
+    def load_content(filename):
+        with open(filename, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+
+        GameEngine.SCENES = content["scenes"]
+        GameEngine.ITEMS = content.get("items", {})
+        GameEngine.SIDOROVICH_SHOP = content.get("shop", {})
+        GameEngine.ACTION_LABELS = content.get("actions", {})
+
+        GameEngine.TRANSITIONS = {
+            (scene_id, action): target
+            for scene_id, scene in GameEngine.SCENES.items()
+            for action, target in scene.get("transitions", {}).items()
+        }
+        GameEngine.BACK_SCENES = {
+            scene_id: scene["back"] for scene_id, scene in GameEngine.SCENES.items() if "back" in scene
+        }
+        GameEngine.NEXT_SCENES = {
+            scene_id: frozenset(scene.get("transitions", {}).values()) | (
+                {scene["back"]} if "back" in scene else set()
+            )
+            for scene_id, scene in GameEngine.SCENES.items()
         }
-    }
+        GameEngine.ITEM_CODES = {
+            item_id: item["code"] for item_id, item in GameEngine.ITEMS.items() if "code" in item
+        }
+        GameEngine.ITEMS_BY_CODE = {code: item_id for item_id, code in GameEngine.ITEM_CODES.items()}
+        GameEngine.ITEM_TITLES = {
+            item_id: f"{item['emoji']} {item.get('name', item_id)}" if item.get("emoji") else item.get("name", item_id)
+            for item_id, item in GameEngine.ITEMS.items()
+        }
+        GameEngine.STACKABLE_ITEMS = frozenset(
+            item_id for item_id, item in GameEngine.ITEMS.items() if item.get("stackable")
+        )
+        GameEngine.compile_scene_texts()
+
+    # Проверка контента при запуске: is_handled(scene, action) сообщает, есть ли обработчик в коде
+    @staticmethod
+    def validate(is_handled):
+        errors = []
+        for scene_id, scene in GameEngine.SCENES.items():
+            for action in scene.get("actions", []):
+                if (scene_id, action) not in GameEngine.TRANSITIONS and not is_handled(scene_id, action):
+                    errors.append(f"{scene_id}: действие '{action}' никуда не ведет")
+            for target in GameEngine.NEXT_SCENES[scene_id]:
+                if target not in GameEngine.SCENES:
+                    errors.append(f"{scene_id}: переход в несуществующую сцену '{target}'")
+        for item_id in GameEngine.ITEMS:
+            if item_id not in GameEngine.ITEM_CODES:
+                errors.append(f"предмет '{item_id}' без кода")
+        if len(GameEngine.ITEMS_BY_CODE) != len(GameEngine.ITEM_CODES):
+            errors.append("у разных предметов одинаковые коды")
+        for item_id in GameEngine.SIDOROVICH_SHOP:
+            if item_id not in GameEngine.ITEMS:
+                errors.append(f"магазин: неизвестный предмет '{item_id}'")
 
-    SIDOROVICH_SHOP = {
-        "pistol": 1000
-    }
+        if errors:
+            raise ValueError("Ошибки в контенте игры:\n" + "\n".join(errors))
+
+    @staticmethod
+    def compile_scene_texts():
+        GameEngine.SCENE_TEXTS = {
+            scene_id: SceneText(scene.get("text", ""), scene.get("greetings"))
+            for scene_id, scene in GameEngine.SCENES.items()
+        }
+        GameEngine._render_scene_text.cache_clear()
 
     @staticmethod
     def get_scene_text(scene_id, user_name=""):
-        scene = GameEngine.SCENES.get(scene_id, {})
-        text_template = scene.get("text", "Сцена не найдена.")
+        scene_text = GameEngine.SCENE_TEXTS.get(scene_id)
+        if scene_text is None:
+            return "Сцена не найдена."
+        if scene_text.pool:
+            return scene_random.get().choice(scene_text.pool)
+        if scene_text.static is not None:
+            return scene_text.static
+        return GameEngine._render_scene_text(scene_id, user_name or "Сталкер")
 
-        # Если текст - функция, вызываем её с именем
-        if callable(text_template):
-            return text_template(user_name or "Сталкер")
-        return text_template
+    @staticmethod
+    @functools.lru_cache(maxsize=SCENE_TEXT_CACHE_SIZE)
+    def _render_scene_text(scene_id, user_name):
+        return GameEngine.SCENE_TEXTS[scene_id].template.format(user_name=user_name)
 
     @staticmethod
     def get_scene_actions(scene_id):
-        return GameEngine.SCENES.get(scene_id, {}).get("actions", [])
\ No newline at end of file
+        return GameEngine.SCENES.get(scene_id, {}).get("actions", [])
+
+    @staticmethod
+    def get_transition(scene_id, action):
+        return GameEngine.TRANSITIONS.get((scene_id, action))
+
+    @staticmethod
+    def get_back_scene(scene_id):
+        # Если у сцены нет выхода назад, игрок остается на месте
+        return GameEngine.BACK_SCENES.get(scene_id, scene_id)
+
+
+GameEngine.load_content(CONTENT_FILE)
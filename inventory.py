@@ -0,0 +1,75 @@
+from collections import Counter
+from typing import Iterable, Iterator, List
+
+from game_engine import GameEngine
+
+
+# Инвентарь игрока: предмет -> количество. Проверка наличия и количество - O(1).
+# В хранилище инвентарь остается списком id, количество - повторами id в списке
+# (["medkit", "medkit", "pistol"]), поэтому формат записей у бэкендов не меняется.
+# Несколько штук можно держать только предметов со "stackable": true в контенте,
+# остальные есть или нет
+class Inventory:
+    __slots__ = ("_counts",)
+
+    def __init__(self, items: Iterable[str] = ()):
+        self._counts = Counter()
+        self.apply(add=items)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._counts
+
+    def __len__(self) -> int:
+        return sum(self._counts.values())
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._counts)
+
+    def count(self, item_id: str) -> int:
+        return self._counts.get(item_id, 0)
+
+    def _add(self, item_id: str, quantity: int) -> bool:
+        current = self._counts.get(item_id, 0)
+        limit = current + quantity if item_id in GameEngine.STACKABLE_ITEMS else 1
+        new = min(current + quantity, limit)
+        if new <= current:
+            return False
+        self._counts[item_id] = new
+        return True
+
+    def _remove(self, item_id: str, quantity: int) -> bool:
+        current = self._counts.get(item_id, 0)
+        if not current:
+            return False
+        if current <= quantity:
+            del self._counts[item_id]
+        else:
+            self._counts[item_id] = current - quantity
+        return True
+
+    # Пачка изменений за раз: сначала забираются remove, затем выдаются add.
+    # Повтор id в пачке - несколько штук. Возвращает, изменился ли инвентарь
+    def apply(self, add: Iterable[str] = (), remove: Iterable[str] = ()) -> bool:
+        changed = False
+        for item_id, quantity in Counter(remove).items():
+            changed |= self._remove(item_id, quantity)
+        for item_id, quantity in Counter(add).items():
+            changed |= self._add(item_id, quantity)
+        return changed
+
+    def add(self, item_id: str, quantity: int = 1) -> bool:
+        return self._add(item_id, quantity)
+
+    def remove(self, item_id: str, quantity: int = 1) -> bool:
+        return self._remove(item_id, quantity)
+
+    def to_list(self) -> List[str]:
+        return list(self._counts.elements())
+
+    # Строки для показа игроку: "🔑 Ключ от X18", "💊 Аптечка ×3"
+    def lines(self) -> List[str]:
+        lines = []
+        for item_id, count in self._counts.items():
+            title = GameEngine.ITEM_TITLES.get(item_id) or f"• {item_id}"
+            lines.append(f"{title} ×{count}" if count > 1 else title)
+        return lines
@@ -0,0 +1,77 @@
+from types import MappingProxyType
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from game_engine import GameEngine
+
+# Все клавиатуры собираются один раз при запуске: разметка в PTB неизменяемая,
+# поэтому один объект можно отдавать во все ответы
+
+
+def single_button(text: str, action: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=f"action_{action}")]])
+
+
+def _build_scene_keyboard(scene_id: str) -> InlineKeyboardMarkup:
+    keyboard = []
+
+    for action in GameEngine.get_scene_actions(scene_id):
+        if action in GameEngine.ACTION_LABELS:
+            keyboard.append([InlineKeyboardButton(
+                GameEngine.ACTION_LABELS[action],
+                callback_data=f"action_{action}"
+            )])
+
+    # Кнопка меню
+    keyboard.append([InlineKeyboardButton(
+        "📱 Меню",
+        callback_data="action_menu"
+    )])
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+SCENE_KEYBOARDS = MappingProxyType({
+    scene_id: _build_scene_keyboard(scene_id) for scene_id in GameEngine.SCENES
+})
+
+# Для неизвестной сцены остается только кнопка меню
+DEFAULT_KEYBOARD = _build_scene_keyboard("")
+
+MENU_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📦 Инвентарь", callback_data="action_inventory"),
+        InlineKeyboardButton("👤 Статистика", callback_data="action_stats"),
+    ],
+    [
+        InlineKeyboardButton("💼 Квесты", callback_data="action_quests"),
+        InlineKeyboardButton("❓ Помощь", callback_data="action_help"),
+    ],
+    [InlineKeyboardButton("🏠 На главную", callback_data="action_main")]
+])
+
+BACK_TO_MENU_KEYBOARD = single_button("🔙 Назад в меню", "menu")
+
+INVENTORY_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔙 Назад в меню", callback_data="action_menu"),
+    InlineKeyboardButton("🏠 На главную", callback_data="action_main"),
+]])
+
+BACK_KEYBOARD = single_button("🔙 Назад", "back")
+
+SHOP_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Купить пистолет", callback_data="action_buy_gun")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="action_back")],
+])
+
+INTRO_KEYBOARD = single_button("Далее", "next")
+CRASH_KEYBOARD = single_button("Далее", "next1")
+WAKE_UP_KEYBOARD = single_button("Что происходит?", "next2")
+USE_KEY_KEYBOARD = single_button("🔑 Использовать ключ", "use_key")
+ENTER_LAB_KEYBOARD = single_button("Войти", "lab_x18_in")
+SHOOT_KEYBOARD = single_button("СТРЕЛЯТЬ!", "shoot")
+
+
+# Клавиатура сцены. user_data оставлен для будущих кнопок, зависящих от состояния игрока
+def generate_keyboard(scene_id, user_data=None) -> InlineKeyboardMarkup:
+    return SCENE_KEYBOARDS.get(scene_id, DEFAULT_KEYBOARD)
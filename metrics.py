@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Квантили считаются по последним SAMPLE_SIZE замерам каждой серии
+SAMPLE_SIZE = 1024
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Summary:
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantile(self, fraction: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+# Счетчики и сводки задержек в памяти процесса. Запись идет и из событийного цикла,
+# и из потоков хранилища, поэтому всё под одной блокировкой.
+# Выводятся в текстовом формате Prometheus: render()
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.summaries: Dict[Tuple[str, Tuple], Summary] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                summary = self.summaries[key] = Summary()
+            summary.observe(value)
+
+    # Замер времени блока в секундах, работает и вокруг await
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    # Значение счетчика, сложенное по всем меткам
+    def total(self, name: str) -> float:
+        with self._lock:
+            return sum(value for (metric, _), value in self.counters.items() if metric == name)
+
+    # [(метки, число замеров, p50, p99)] для одной сводки, самые частые первыми
+    def percentiles(self, name: str) -> List[Tuple[Dict[str, str], int, float, float]]:
+        with self._lock:
+            rows = [
+                (dict(labels), summary.count, summary.quantile(0.5), summary.quantile(0.99))
+                for (metric, labels), summary in self.summaries.items() if metric == name
+            ]
+        return sorted(rows, key=lambda row: row[1], reverse=True)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            summaries = sorted(self.summaries.items(), key=lambda item: item[0])
+
+            declared = set()
+            for (name, labels), value in counters:
+                if name not in declared:
+                    lines.append(f"# TYPE {name} counter")
+                    declared.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+            for (name, labels), summary in summaries:
+                if name not in declared:
+                    lines.append(f"# TYPE {name} summary")
+                    declared.add(name)
+                for fraction in QUANTILES:
+                    lines.append(f"{name}{_format_labels(labels, (('quantile', fraction),))} "
+                                 f"{summary.quantile(fraction):.6f}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {summary.total:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {summary.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# Периодический сброс метрик в лог для запуска без вебхука (там метрики отдаются по GET)
+async def log_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Метрики:\n%s", metrics.render())
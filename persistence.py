@@ -0,0 +1,85 @@
+import copy
+from typing import Any, Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import AsyncStorage
+
+UserData = Dict[str, Any]
+
+
+# Хранилище игроков в роли persistence для PTB: игрок живет в context.user_data,
+# загружается из хранилища при своем первом апдейте (refresh_user_data), а обратно
+# пишутся только изменившиеся поля - раз в update_interval секунд и при остановке бота.
+# Работает с любым бэкендом (json, journal, sqlite, шарды): нужны только get_user и update_user.
+# chat_data, bot_data, callback_data и диалоги не сохраняются
+class StoragePersistence(BasePersistence[UserData, Dict, Dict]):
+    def __init__(self, storage: AsyncStorage, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.storage = storage
+        # Что последний раз прочитано из хранилища или записано в него: по нему ищутся изменения
+        self._saved: Dict[int, UserData] = {}
+
+    async def get_user_data(self) -> Dict[int, UserData]:
+        # Игроки не загружаются все при старте, а подтягиваются по одному
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: UserData):
+        if user_data:
+            return
+        loaded = await self.storage.get_user(str(user_id))
+        # Пока шло чтение, параллельный апдейт того же игрока мог уже загрузить и изменить его
+        if not user_data:
+            self._saved[user_id] = copy.deepcopy(loaded)
+            user_data.update(loaded)
+
+    async def update_user_data(self, user_id: int, data: UserData):
+        saved = self._saved.get(user_id, {})
+        changes = {key: value for key, value in data.items() if key not in saved or saved[key] != value}
+        if not changes:
+            return
+        # data - уже копия, которую PTB делает для persistence, её можно запомнить как есть
+        await self.storage.update_user(str(user_id), changes)
+        self._saved[user_id] = data
+
+    async def drop_user_data(self, user_id: int):
+        self._saved.pop(user_id, None)
+
+    async def flush(self):
+        await self.storage.flush()
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def update_callback_data(self, data: Any):
+        pass
+
+    async def update_conversation(self, name: str, key, new_state: Optional[object]):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
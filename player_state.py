@@ -0,0 +1,131 @@
+from typing import Any, Dict, List
+
+from game_engine import GameEngine
+
+# Флаги прохождения квеста упакованы в одно число: флаг -> бит.
+# Новые флаги добавляются только в конец, иначе сохраненные биты поменяют смысл
+QUEST_FLAGS = (
+    "has_talked_stalker",
+    "has_found_key",
+    "has_door_open",
+    "has_killed",
+    "has_found_doc",
+)
+FLAG_BITS = {name: 1 << index for index, name in enumerate(QUEST_FLAGS)}
+
+# Поля словаря игрока, которые PlayerState хранит сам; остальные уходят в extra
+_FIELDS = ("user_id", "user_name", "current_scene", "money", "health", "points", "inventory") + QUEST_FLAGS
+
+
+# Компактное состояние игрока. Конвертируется в текущий формат словаря и обратно без потерь,
+# поэтому код бота можно переводить на него постепенно
+class PlayerState:
+    __slots__ = ("user_id", "user_name", "current_scene", "money", "health", "points",
+                 "flags", "inventory", "extra")
+
+    def __init__(self, user_id: str, user_name: str = "", current_scene: str = "start",
+                 money: int = 1500, health: int = 100, points: int = 0, flags: int = 0,
+                 inventory: tuple = (), extra: Dict[str, Any] = None):
+        self.user_id = user_id
+        self.user_name = user_name
+        self.current_scene = current_scene
+        self.money = money
+        self.health = health
+        self.points = points
+        self.flags = flags
+        # Коды предметов в порядке получения, несколько штук - повтором кода;
+        # предметы без кода в контенте хранятся строкой
+        self.inventory = inventory
+        self.extra = extra
+
+    def has_flag(self, name: str) -> bool:
+        return bool(self.flags & FLAG_BITS[name])
+
+    def set_flag(self, name: str, value: bool = True):
+        if value:
+            self.flags |= FLAG_BITS[name]
+        else:
+            self.flags &= ~FLAG_BITS[name]
+
+    @staticmethod
+    def _encode_item(item_id: str):
+        return GameEngine.ITEM_CODES.get(item_id, item_id)
+
+    @staticmethod
+    def _decode_item(code) -> str:
+        return GameEngine.ITEMS_BY_CODE.get(code, code) if isinstance(code, int) else code
+
+    def has_item(self, item_id: str) -> bool:
+        return self._encode_item(item_id) in self.inventory
+
+    def count_item(self, item_id: str) -> int:
+        return self.inventory.count(self._encode_item(item_id))
+
+    # Правила количества те же, что у Inventory: несколько штук только у stackable-предметов
+    def add_item(self, item_id: str, quantity: int = 1):
+        code = self._encode_item(item_id)
+        if item_id not in GameEngine.STACKABLE_ITEMS:
+            quantity = 0 if code in self.inventory else 1
+        self.inventory += (code,) * quantity
+
+    def remove_item(self, item_id: str, quantity: int = 1):
+        code = self._encode_item(item_id)
+        inventory = list(self.inventory)
+        for _ in range(quantity):
+            if code not in inventory:
+                break
+            inventory.remove(code)
+        self.inventory = tuple(inventory)
+
+    def items(self) -> List[str]:
+        return [self._decode_item(code) for code in self.inventory]
+
+    @classmethod
+    def from_dict(cls, user_data: Dict[str, Any]) -> "PlayerState":
+        flags = 0
+        for name in QUEST_FLAGS:
+            if user_data.get(name):
+                flags |= FLAG_BITS[name]
+        extra = {key: value for key, value in user_data.items() if key not in _FIELDS}
+
+        return cls(
+            user_id=str(user_data.get("user_id", "")),
+            user_name=user_data.get("user_name", ""),
+            current_scene=user_data.get("current_scene", "start"),
+            money=user_data.get("money", 1500),
+            health=user_data.get("health", 100),
+            points=user_data.get("points", 0),
+            flags=flags,
+            inventory=tuple(cls._encode_item(item_id) for item_id in user_data.get("inventory", [])),
+            extra=extra or None,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        user_data = {
+            "user_id": self.user_id,
+            "user_name": self.user_name,
+            "current_scene": self.current_scene,
+            "inventory": self.items(),
+            "money": self.money,
+            "health": self.health,
+            "points": self.points,
+        }
+        for name in QUEST_FLAGS:
+            user_data[name] = self.has_flag(name)
+        if self.extra:
+            user_data.update(self.extra)
+        return user_data
+
+    # Запись без имен полей: [user_id, имя, сцена, деньги, здоровье, очки, флаги, [предметы], extra?]
+    def to_compact(self) -> list:
+        record = [self.user_id, self.user_name, self.current_scene, self.money, self.health,
+                  self.points, self.flags, list(self.inventory)]
+        if self.extra:
+            record.append(self.extra)
+        return record
+
+    @classmethod
+    def from_compact(cls, record: list) -> "PlayerState":
+        user_id, user_name, current_scene, money, health, points, flags, inventory = record[:8]
+        extra = record[8] if len(record) > 8 else None
+        return cls(user_id, user_name, current_scene, money, health, points, flags, tuple(inventory), extra)
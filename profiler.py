@@ -0,0 +1,112 @@
+import asyncio
+import cProfile
+import functools
+import logging
+import marshal
+import os
+import pstats
+import random
+import time
+from collections import Counter
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+# Выборочное профилирование хендлеров бота. Профилируется доля sample_rate апдейтов,
+# а при slow_threshold > 0 - каждый апдейт, но сохраняются только те, что шли дольше порога.
+# Одновременно профилируется не больше одного апдейта: cProfile видит весь поток,
+# поэтому в профиль попадают и апдейты других игроков, выполнявшиеся в это время.
+# Профили копятся по имени хендлера и пишутся в directory/<хендлер>.pstats
+# (открываются pstats, snakeviz, flameprof для flamegraph). Раз в dump_interval файлы
+# переписываются в отдельном потоке, чтобы запись на диск не задерживала апдейт.
+# Выключенный профилировщик - одна проверка атрибута на апдейт
+class SamplingProfiler:
+    def __init__(self, sample_rate: float = 0.0, slow_threshold: float = 0.0,
+                 directory: str = "data/profiles", dump_interval: float = 60):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.profiled = Counter()
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._busy = False
+        self._last_dump = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_threshold > 0
+
+    def wrap(self, callback):
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            if not self.enabled or self._busy:
+                return await callback(update, context)
+            sampled = random.random() < self.sample_rate
+            if not sampled and not self.slow_threshold:
+                return await callback(update, context)
+            return await self._profile(callback, update, context, sampled)
+
+        return wrapper
+
+    async def _profile(self, callback, update, context, sampled: bool):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик
+            return await callback(update, context)
+
+        self._busy = True
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            profile.disable()
+            self._busy = False
+            elapsed = time.perf_counter() - started
+            if sampled or (self.slow_threshold and elapsed >= self.slow_threshold):
+                self._record(callback.__name__, profile)
+
+    def _record(self, name: str, profile: cProfile.Profile):
+        stats = self._stats.get(name)
+        if stats is None:
+            self._stats[name] = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+        self.profiled[name] += 1
+
+        if time.monotonic() - self._last_dump >= self.dump_interval:
+            self._last_dump = time.monotonic()
+            asyncio.get_running_loop().run_in_executor(None, self._write_logged, self._snapshot())
+
+    # Копия профилей для записи из другого потока: Stats.add заменяет записи новыми кортежами,
+    # а не меняет старые, так что хватает неглубокой копии
+    def _snapshot(self) -> Dict[str, dict]:
+        return {name: dict(stats.stats) for name, stats in self._stats.items()}
+
+    # Тот же формат, что у Stats.dump_stats
+    def _write(self, snapshot: Dict[str, dict]) -> List[str]:
+        paths = []
+        if snapshot:
+            os.makedirs(self.directory, exist_ok=True)
+        for name, data in snapshot.items():
+            path = os.path.join(self.directory, f"{name}.pstats")
+            with open(path, 'wb') as f:
+                marshal.dump(data, f)
+            paths.append(path)
+        return paths
+
+    def _write_logged(self, snapshot: Dict[str, dict]):
+        try:
+            self._write(snapshot)
+        except OSError:
+            logger.exception("Не удалось записать профили в %s", self.directory)
+
+    def dump(self) -> List[str]:
+        self._last_dump = time.monotonic()
+        return self._write(self._snapshot())
+
+    def reset(self):
+        self._stats.clear()
+        self.profiled.clear()
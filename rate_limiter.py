@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import Counter
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих запросов: ответы на действия игрока идут первыми,
+# массовые рассылки - только когда в общем лимите остается запас
+PRIORITY_HIGH = "high"
+PRIORITY_LOW = "low"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Сколько ждать, пока в ведре наберется needed токенов (0 - уже есть)
+    def wait_time(self, needed: float = 1) -> float:
+        self._refill(time.monotonic())
+        return max(0.0, (needed - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+# Планировщик исходящих запросов к Bot API с учетом лимитов Telegram:
+# общее ведро на бота, отдельные ведра на каждый чат (у групп лимит строже),
+# а при 429 (RetryAfter) все запросы ставятся на паузу и неудавшийся повторяется.
+# Запросы без chat_id (answerCallbackQuery, getMe) не задерживаются.
+# Приоритет передается через rate_limit_args={"priority": PRIORITY_LOW} у методов бота.
+# shared_pause - multiprocessing.Value("d") на все процессы бота (cluster.py): 429 относится
+# ко всему боту, и пауза, полученная одним воркером, останавливает и остальные
+class FloodRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    # Сколько ведер чатов держать, прежде чем выбрасывать простаивающие
+    MAX_IDLE_BUCKETS = 10000
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, low_priority_reserve: float = 10, max_retries: int = 3,
+                 shared_pause: Optional[multiprocessing.Value] = None):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.low_priority_reserve = low_priority_reserve
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._shared_pause = shared_pause
+
+        # Метрики: requests, delayed, retry_after, failed и суммарное время ожидания.
+        # Те же числа уходят в общие метрики как telegram_rate_limit_*_total
+        self.stats = Counter()
+        self.wait_seconds = 0.0
+
+    async def initialize(self):
+        pass
+
+    def _count(self, name: str, endpoint: str):
+        self.stats[name] += 1
+        metrics.inc(f"telegram_rate_limit_{name}_total", endpoint=endpoint)
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_IDLE_BUCKETS:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full()
+                }
+            # У групп и каналов chat_id отрицательный или это @username
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            if is_private:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    # time.monotonic() общий для всех процессов машины, поэтому момент окончания паузы
+    # можно хранить в разделяемой памяти как есть
+    def _pause_left(self) -> float:
+        paused_until = self._paused_until
+        if self._shared_pause is not None:
+            paused_until = max(paused_until, self._shared_pause.value)
+        return paused_until - time.monotonic()
+
+    def _pause(self, seconds: float):
+        until = time.monotonic() + seconds
+        self._paused_until = max(self._paused_until, until)
+        if self._shared_pause is not None:
+            with self._shared_pause.get_lock():
+                self._shared_pause.value = max(self._shared_pause.value, until)
+
+    @staticmethod
+    async def _acquire(bucket: TokenBucket, needed: float = 1) -> float:
+        waited = 0.0
+        while True:
+            delay = bucket.wait_time(needed)
+            if delay <= 0:
+                bucket.take()
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    async def _wait_for_slot(self, chat_id, priority: str, endpoint: str):
+        waited = 0.0
+        pause = self._pause_left()
+        if pause > 0:
+            await asyncio.sleep(pause)
+            waited += pause
+
+        waited += await self._acquire(self._chat_bucket(chat_id))
+        reserve = self.low_priority_reserve if priority == PRIORITY_LOW else 0
+        waited += await self._acquire(self.global_bucket, reserve + 1)
+
+        if waited:
+            self._count("delayed", endpoint)
+            self.wait_seconds += waited
+            metrics.inc("telegram_rate_limit_wait_seconds_total", waited, endpoint=endpoint)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ):
+        chat_id = data.get("chat_id")
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_HIGH)
+        self._count("requests", endpoint)
+
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._wait_for_slot(chat_id, priority, endpoint)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as error:
+                self._count("retry_after", endpoint)
+                retry_after = error.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                self._pause(retry_after)
+                if attempt == self.max_retries:
+                    self._count("failed", endpoint)
+                    raise
+                logger.warning("%s: Telegram просит подождать %s с (попытка %s)", endpoint, retry_after, attempt + 1)
+                if chat_id is None:
+                    await asyncio.sleep(retry_after)
+
+
+# Создает планировщик согласно настройкам RATE_LIMIT_* в config.py.
+# workers - сколько процессов отправляют сообщения от имени бота: каждому достается своя доля общего лимита
+def create_rate_limiter(workers: int = 1, shared_pause: Optional[multiprocessing.Value] = None) -> FloodRateLimiter:
+    from config import (
+        RATE_LIMIT_GLOBAL, RATE_LIMIT_CHAT, RATE_LIMIT_CHAT_BURST, RATE_LIMIT_GROUP, RATE_LIMIT_MAX_RETRIES
+    )
+
+    global_rate = RATE_LIMIT_GLOBAL / workers
+    return FloodRateLimiter(
+        global_rate=global_rate,
+        chat_rate=RATE_LIMIT_CHAT,
+        chat_burst=RATE_LIMIT_CHAT_BURST,
+        group_rate=RATE_LIMIT_GROUP,
+        # Запас для ответов игрокам - треть ведра (при 30 в секунду те же 10): с запасом больше
+        # доли воркера рассылки не ушли бы никогда
+        low_priority_reserve=global_rate / 3,
+        max_retries=RATE_LIMIT_MAX_RETRIES,
+        shared_pause=shared_pause,
+    )
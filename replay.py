@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+import bot
+from benchmark import create_benchmark_storage, percentile
+from fake_telegram import create_fake_bot
+from game_engine import scene_random
+from player_state import PlayerState
+from storage import iter_json_users
+from update_trace import read_trace
+
+logger = logging.getLogger(__name__)
+
+# Воспроизведение записанной трассы (TRACE_FILE в config.py) через настоящие хендлеры:
+# Telegram подменен поддельным API, игроки лежат во временном хранилище (можно начать с копии базы).
+# Апдейты одного игрока идут строго по порядку, разных игроков - параллельно, как в жизни.
+# Случайные тексты детерминированы: у каждого апдейта свой генератор с зерном "seed:update_id",
+# поэтому отпечаток ответов совпадает между прогонами и меняется только вместе с поведением бота.
+#   python replay.py data/trace.jsonl                        - как можно быстрее
+#   python replay.py data/trace.jsonl --speed 1              - в исходном темпе (2 - вдвое быстрее)
+#   python replay.py data/trace.jsonl --snapshot data/users.json --backend sqlite
+
+
+def update_label(update: Update) -> str:
+    if update.callback_query:
+        return (update.callback_query.data or "").replace("action_", "")
+    if update.message and update.message.text:
+        if update.message.text.startswith("/"):
+            return update.message.text.split()[0]
+        return "text"
+    return "other"
+
+
+async def replay_update(application: Application, update: Update, previous: asyncio.Task, seed: int,
+                        latencies: Dict[str, List[float]]):
+    # Предыдущий апдейт того же игрока должен закончиться раньше
+    if previous is not None:
+        await asyncio.wait([previous])
+    scene_random.set(random.Random(f"{seed}:{update.update_id}"))
+
+    started = time.perf_counter()
+    await application.process_update(update)
+    latencies[update_label(update)].append(time.perf_counter() - started)
+
+
+def load_snapshot(storage, filename: str) -> int:
+    count = 0
+    for user_id, record in iter_json_users(filename):
+        if isinstance(record, list):
+            record = PlayerState.from_compact(record).to_dict()
+        storage.update_user(str(user_id), record)
+        count += 1
+    storage.flush()
+    return count
+
+
+def replies_digest(replies: Dict) -> str:
+    digest = hashlib.md5()
+    for chat_id in sorted(replies, key=str):
+        digest.update(f"{chat_id}\n".encode("utf-8"))
+        for text in replies[chat_id]:
+            digest.update(text.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+async def run_replay(path: str, speed: float, backend: str, seed: int, snapshot: str = ""):
+    records = list(read_trace(path))
+    if not records:
+        print(f"В трассе {path} нет апдейтов")
+        return
+
+    errors = Counter()
+
+    async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+        label = update_label(update) if isinstance(update, Update) else "?"
+        errors[f"{label}: {type(context.error).__name__}: {context.error}"] += 1
+        logger.error("Ошибка при обработке %s", label, exc_info=context.error)
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = create_benchmark_storage(backend, directory, flush_interval=5)
+        if snapshot:
+            print(f"Загружено игроков из {snapshot}: {load_snapshot(storage, snapshot)}")
+        bot.open_storage(storage)
+        # Воспроизведение не должно писать новую трассу
+        bot.tracer.path = ""
+
+        fake_bot, request = await create_fake_bot(keep_replies=True)
+        application = Application.builder().bot(fake_bot).updater(None).build()
+        bot.register_handlers(application)
+        application.add_error_handler(on_error)
+
+        latencies = defaultdict(list)
+        previous = {}
+        tasks = []
+        first_time = records[0]["t"]
+        lag = 0.0
+        async with application:
+            started = time.perf_counter()
+            for record in records:
+                if speed:
+                    delay = (record["t"] - first_time) / speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        lag = max(lag, -delay)
+                update = Update.de_json(record["u"], application.bot)
+                user_id = update.effective_user.id if update.effective_user else None
+                task = asyncio.create_task(
+                    replay_update(application, update, previous.get(user_id), seed, latencies)
+                )
+                previous[user_id] = task
+                tasks.append(task)
+            await asyncio.gather(*tasks)
+            await bot.storage.flush()
+            elapsed = time.perf_counter() - started
+        await bot.storage.close()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"Трасса: {path}, апдейтов: {total}, игроков: {len(previous)}, бэкенд: {backend}")
+    print(f"Время: {elapsed:.2f} с, {total / elapsed:.0f} апдейтов/с"
+          + (f", исходное: {(records[-1]['t'] - first_time):.2f} с, макс. отставание: {lag * 1000:.0f} мс"
+             if speed else ""))
+    print(f"\n{'действие':<24}{'число':>8}{'p50 мс':>9}{'p90 мс':>9}{'p99 мс':>9}{'макс мс':>9}{'всего с':>9}")
+    for label, values in sorted(latencies.items(), key=lambda item: sum(item[1]), reverse=True):
+        values.sort()
+        print(f"{label[:23]:<24}{len(values):>8}"
+              f"{percentile(values, 0.5) * 1000:>9.2f}{percentile(values, 0.9) * 1000:>9.2f}"
+              f"{percentile(values, 0.99) * 1000:>9.2f}{values[-1] * 1000:>9.2f}{sum(values):>9.2f}")
+
+    print(f"\nЗапросов к Bot API: {sum(request.calls.values())} {dict(request.calls)}")
+    print(f"Отпечаток ответов: {replies_digest(request.replies)}")
+    if errors:
+        print(f"\nОшибки ({sum(errors.values())}):")
+        for error, count in errors.most_common():
+            print(f"  {count} x {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанной трассы апдейтов")
+    parser.add_argument("trace", help="файл трассы (TRACE_FILE)")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="темп относительно записи: 1 - исходный, 2 - вдвое быстрее, 0 - без пауз")
+    parser.add_argument("--backend", choices=["json", "journal", "sqlite"], default="json")
+    parser.add_argument("--seed", type=int, default=0, help="зерно для случайных текстов")
+    parser.add_argument("--snapshot", default="", help="начать с копии игроков из users.json")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run_replay(args.trace, args.speed, args.backend, args.seed, args.snapshot))
+
+
+if __name__ == "__main__":
+    main()
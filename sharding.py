@@ -0,0 +1,100 @@
+import sys
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator
+
+from storage import BaseStorage, create_backend
+
+
+# Игроки разложены по нескольким хранилищам по хэшу user_id. У каждого шарда свой файл
+# и своя блокировка, поэтому разные шарды можно обслуживать параллельно, а процесс
+# может открывать только свои шарды (owned)
+class ShardedStorage(BaseStorage):
+    def __init__(self, create_shard: Callable[[int], BaseStorage], count: int, owned: Iterable[int] = None):
+        self.count = count
+        self.owned = set(range(count)) if owned is None else set(owned)
+        self.shards = {index: create_shard(index) for index in sorted(self.owned)}
+        self._locks = {index: threading.Lock() for index in self.shards}
+
+    @staticmethod
+    def shard_index(user_id: str, count: int) -> int:
+        # crc32 стабилен между запусками, в отличие от hash() для строк
+        return zlib.crc32(str(user_id).encode('utf-8')) % count
+
+    def _shard(self, user_id: str):
+        index = self.shard_index(user_id, self.count)
+        if index not in self.shards:
+            raise ValueError(f"Игрок {user_id} лежит в шарде {index}, который обслуживает другой процесс")
+        return index, self.shards[index]
+
+    def get_user(self, user_id: str) -> Dict[str, Any]:
+        index, shard = self._shard(user_id)
+        with self._locks[index]:
+            return shard.get_user(user_id)
+
+    def update_user(self, user_id: str, updates: Dict[str, Any]):
+        index, shard = self._shard(user_id)
+        with self._locks[index]:
+            shard.update_user(user_id, updates)
+
+    def delete_user(self, user_id: str):
+        index, shard = self._shard(user_id)
+        with self._locks[index]:
+            shard.delete_user(user_id)
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        for shard in self.shards.values():
+            yield from shard.iter_users()
+
+    def scan(self) -> Iterator[Dict[str, Any]]:
+        for shard in self.shards.values():
+            yield from shard.scan()
+
+    # Каждый шард обновляется своим способом (JSON-шард без кэша - потоковой перезаписью)
+    def bulk_update(self, select, chunk_size: int = 500) -> int:
+        updated = 0
+        for index, shard in self.shards.items():
+            with self._locks[index]:
+                updated += shard.bulk_update(select, chunk_size)
+        return updated
+
+    def flush(self):
+        for index, shard in self.shards.items():
+            with self._locks[index]:
+                shard.flush()
+
+    def close(self):
+        for index, shard in self.shards.items():
+            with self._locks[index]:
+                shard.close()
+
+
+# Офлайн-перекладка игроков из old_count шардов в new_count (бот должен быть остановлен).
+# Новые файлы получают другие имена, старые остаются на месте до ручного удаления
+def reshard(backend: str, old_count: int, new_count: int) -> int:
+    source = ShardedStorage(lambda index: create_backend(backend, index, old_count, evict_interval=0), old_count)
+    target = ShardedStorage(
+        lambda index: create_backend(backend, index, new_count, flush_interval=float("inf"), evict_interval=0),
+        new_count
+    )
+
+    moved = 0
+    for user_data in source.iter_users():
+        target.update_user(str(user_data["user_id"]), user_data)
+        moved += 1
+
+    source.close()
+    target.close()
+    return moved
+
+
+if __name__ == "__main__":
+    # python sharding.py 1 4  - разложить игроков из одного файла по четырем шардам
+    if len(sys.argv) != 3:
+        print("Использование: python sharding.py <было шардов> <стало шардов>")
+        sys.exit(1)
+
+    from config import STORAGE_BACKEND
+
+    count = reshard(STORAGE_BACKEND, int(sys.argv[1]), int(sys.argv[2]))
+    print(f"Перенесено игроков: {count}. Укажите STORAGE_SHARDS = {sys.argv[2]} в config.py")
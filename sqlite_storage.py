@@ -0,0 +1,193 @@
+import json
+import os
+import sqlite3
+import sys
+from typing import Any, Dict, Iterator, List, Tuple
+
+from player_state import PlayerState
+from storage import BaseStorage, iter_json_users
+
+
+# Хранилище игроков в SQLite: одна строка на игрока, запись только измененных колонок
+class SqliteStorage(BaseStorage):
+    # Колонка -> тип значения в игре
+    COLUMNS = {
+        "user_id": "text",
+        "user_name": "text",
+        "current_scene": "text",
+        "inventory": "json",
+        "money": "int",
+        "health": "int",
+        "points": "int",
+        "has_talked_stalker": "bool",
+        "has_found_key": "bool",
+        "has_door_open": "bool",
+        "has_killed": "bool",
+        "has_found_doc": "bool",
+    }
+
+    SQL_TYPES = {"text": "TEXT", "json": "TEXT", "int": "INTEGER", "bool": "INTEGER"}
+
+    def __init__(self, filename="data/users.db"):
+        self.filename = filename
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self._conn = sqlite3.connect(self.filename, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_table()
+
+    def _create_table(self):
+        columns = ", ".join(
+            f"{name} {self.SQL_TYPES[kind]}" for name, kind in self.COLUMNS.items() if name != "user_id"
+        )
+        with self._conn:
+            # Поля, для которых нет колонки (например, equipment), лежат в extra одним JSON
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, {columns}, extra TEXT NOT NULL DEFAULT '{{}}')"
+            )
+
+    def _encode(self, key: str, value: Any) -> Any:
+        kind = self.COLUMNS[key]
+        if kind == "json":
+            return json.dumps(value, ensure_ascii=False)
+        if kind == "bool":
+            return int(bool(value))
+        return value
+
+    def _decode(self, key: str, value: Any) -> Any:
+        kind = self.COLUMNS[key]
+        if kind == "json":
+            return json.loads(value)
+        if kind == "bool":
+            return bool(value)
+        return value
+
+    def _row_to_user(self, row) -> Dict[str, Any]:
+        names = list(self.COLUMNS) + ["extra"]
+        user_data = {name: self._decode(name, value) for name, value in zip(names, row) if name != "extra"}
+        user_data.update(json.loads(row[-1]))
+        return user_data
+
+    def _split(self, user_data: Dict[str, Any]):
+        columns = {key: self._encode(key, value) for key, value in user_data.items() if key in self.COLUMNS}
+        extra = {key: value for key, value in user_data.items() if key not in self.COLUMNS}
+        return columns, extra
+
+    def _insert(self, user_data: Dict[str, Any], replace=False):
+        columns, extra = self._split(user_data)
+        columns["extra"] = json.dumps(extra, ensure_ascii=False)
+        names = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        conflict = "REPLACE" if replace else "IGNORE"
+        self._execute_write(f"INSERT OR {conflict} INTO users ({names}) VALUES ({placeholders})",
+                            list(columns.values()))
+
+    def _execute_write(self, sql: str, params: list):
+        cursor = self._conn.execute(sql, params)
+        # Считаем объем записанных значений, а не страниц SQLite
+        if cursor.rowcount > 0:
+            self._count_io(written=sum(len(str(value).encode('utf-8')) for value in params))
+
+    def _select(self, user_id: str):
+        names = ", ".join(list(self.COLUMNS) + ["extra"])
+        row = self._conn.execute(f"SELECT {names} FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is not None:
+            self._count_io(read=sum(len(str(value).encode('utf-8')) for value in row))
+        return row
+
+    def get_user(self, user_id: str) -> Dict[str, Any]:
+        user_id = str(user_id)
+        row = self._select(user_id)
+        if row is not None:
+            return self._row_to_user(row)
+
+        # Создаем нового пользователя с дефолтными значениями
+        user_data = self._create_default_user(user_id)
+        with self._conn:
+            self._insert(user_data)
+        return user_data
+
+    def update_user(self, user_id: str, updates: Dict[str, Any]):
+        with self._conn:
+            self._update(str(user_id), updates)
+
+    # Изменение одного игрока без собственной транзакции
+    def _update(self, user_id: str, updates: Dict[str, Any]):
+        self._insert(self._create_default_user(user_id))
+
+        changed = {key: self._encode(key, value) for key, value in updates.items()
+                   if key in self.COLUMNS and key != "user_id"}
+
+        extra_updates = {key: value for key, value in updates.items() if key not in self.COLUMNS}
+        if extra_updates:
+            extra = json.loads(self._conn.execute(
+                "SELECT extra FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()[0])
+            self._apply_updates(extra, extra_updates)
+            changed["extra"] = json.dumps(extra, ensure_ascii=False)
+
+        if changed:
+            assignments = ", ".join(f"{key} = ?" for key in changed)
+            self._execute_write(f"UPDATE users SET {assignments} WHERE user_id = ?",
+                                list(changed.values()) + [user_id])
+
+    def delete_user(self, user_id: str):
+        with self._conn:
+            self._conn.execute("DELETE FROM users WHERE user_id = ?", (str(user_id),))
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        names = ", ".join(list(self.COLUMNS) + ["extra"])
+        cursor = self._conn.execute(f"SELECT {names} FROM users")
+        for row in cursor:
+            yield self._row_to_user(row)
+
+    # Постраничный перебор по первичному ключу: между страницами курсор не держится открытым,
+    # поэтому во время перебора игроков можно изменять
+    def scan(self, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        names = ", ".join(list(self.COLUMNS) + ["extra"])
+        last_id = ""
+        while True:
+            rows = self._conn.execute(
+                f"SELECT {names} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (last_id, page_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._row_to_user(row)
+            last_id = rows[-1][0]
+
+    # Пачка изменений - одна транзакция
+    def _apply_chunk(self, chunk: List[Tuple[str, Dict[str, Any]]]) -> int:
+        with self._conn:
+            for user_id, updates in chunk:
+                self._update(user_id, updates)
+        return len(chunk)
+
+    def close(self):
+        self._conn.close()
+
+    # Разовый перенос игроков из users.json в базу
+    def import_json(self, json_file: str) -> int:
+        count = 0
+        with self._conn:
+            # Файл читается потоково, чтобы большой users.json не загружать в память целиком
+            for user_id, user_data in iter_json_users(json_file):
+                # Компактный формат (STORAGE_COMPACT) хранит игрока списком
+                if isinstance(user_data, list):
+                    user_data = PlayerState.from_compact(user_data).to_dict()
+                user_data = {**self._create_default_user(str(user_id)), **user_data, "user_id": str(user_id)}
+                self._insert(user_data, replace=True)
+                count += 1
+        return count
+
+
+if __name__ == "__main__":
+    # python sqlite_storage.py data/users.json data/users.db
+    if len(sys.argv) != 3:
+        print("Использование: python sqlite_storage.py <users.json> <users.db>")
+        sys.exit(1)
+
+    storage = SqliteStorage(sys.argv[2])
+    count = storage.import_json(sys.argv[1])
+    storage.close()
+    print(f"Перенесено игроков: {count}")
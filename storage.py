@@ -1,44 +1,87 @@
+import asyncio
+import copy
+import functools
 import json
+import logging
 import os
-from typing import Dict, Any
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
+from metrics import metrics
 
-class Storage:
-    def __init__(self, filename="data/users.json"):
-        self.filename = filename
-        self._ensure_directory()
-        self._ensure_file()
+logger = logging.getLogger(__name__)
 
-    def _ensure_directory(self):
-        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
 
-    def _ensure_file(self):
-        if not os.path.exists(self.filename):
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
+# Общий интерфейс хранилища игроков, от него наследуются конкретные бэкенды
+class BaseStorage:
+    # Сколько байт хранилище записало и прочитало и сколько раз вызывало fsync
+    # (для бенчмарков; те же числа уходят в метрики storage_*_total)
+    bytes_written = 0
+    bytes_read = 0
+    fsyncs = 0
 
-    def load_all_users(self) -> Dict[str, Any]:
-        try:
-            with open(self.filename, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
+    def get_user(self, user_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
 
-    def save_all_users(self, data: Dict[str, Any]):
-        with open(self.filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def update_user(self, user_id: str, updates: Dict[str, Any]):
+        raise NotImplementedError
 
-    def get_user(self, user_id: str) -> Dict[str, Any]:
-        users = self.load_all_users()
-        user_data = users.get(str(user_id))
+    def delete_user(self, user_id: str):
+        raise NotImplementedError
 
-        if not user_data:
-            # Создаем нового пользователя с дефолтными значениями
-            user_data = self._create_default_user(user_id)
-            users[str(user_id)] = user_data
-            self.save_all_users(users)
+    # Перебор всех игроков (для обслуживания и переноса данных)
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
 
-        return user_data
+    # Ленивый перебор игроков для обслуживания; бэкенды переопределяют его,
+    # чтобы не держать всех игроков в памяти
+    def scan(self) -> Iterator[Dict[str, Any]]:
+        yield from self.iter_users()
+
+    # Пакетное изменение: select(игрок) возвращает изменения для него или None.
+    # Изменения применяются пачками по chunk_size, после каждой пачки - запись на диск
+    def bulk_update(self, select: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+                    chunk_size: int = 500) -> int:
+        updated = 0
+        chunk = []
+        for user_data in self.scan():
+            updates = select(user_data)
+            if updates:
+                chunk.append((str(user_data["user_id"]), updates))
+            if len(chunk) >= chunk_size:
+                updated += self._apply_chunk(chunk)
+                chunk = []
+        return updated + self._apply_chunk(chunk)
+
+    def _apply_chunk(self, chunk: List[Tuple[str, Dict[str, Any]]]) -> int:
+        for user_id, updates in chunk:
+            self.update_user(user_id, updates)
+        if chunk:
+            self.flush()
+        return len(chunk)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # Принудительная запись при остановке бота
+        self.flush()
+
+    def _count_io(self, written: int = 0, read: int = 0, fsyncs: int = 0):
+        backend = type(self).__name__
+        if written:
+            self.bytes_written += written
+            metrics.inc("storage_bytes_written_total", written, backend=backend)
+        if read:
+            self.bytes_read += read
+            metrics.inc("storage_bytes_read_total", read, backend=backend)
+        if fsyncs:
+            self.fsyncs += fsyncs
+            metrics.inc("storage_fsync_total", fsyncs, backend=backend)
 
     def _create_default_user(self, user_id: str) -> Dict[str, Any]:
         return {
@@ -56,19 +99,12 @@ class Storage:
             "has_found_doc": False
         }
 
-    def update_user(self, user_id: str, updates: Dict[str, Any]):
-        users = self.load_all_users()
-        user_id_str = str(user_id)
-
-        if user_id_str not in users:
-            users[user_id_str] = self._create_default_user(user_id_str)
-
-        user_data = users[user_id_str]
-
+    @staticmethod
+    def _apply_updates(user_data: Dict[str, Any], updates: Dict[str, Any]):
         # Для вложенных структур нужно обновлять корректно
         for key, value in updates.items():
             if key == "inventory" and isinstance(value, list):
-                user_data[key] = value
+                user_data[key] = list(value)
             elif key == "equipment" and isinstance(value, dict):
                 if "equipment" not in user_data:
                     user_data["equipment"] = {}
@@ -76,16 +112,685 @@ class Storage:
             else:
                 user_data[key] = value
 
-        self.save_all_users(users)
+    # Единица работы: все изменения игрока за одно действие записываются одним update_user
+    @contextmanager
+    def session(self, user_id: str):
+        session = UserSession(self, user_id)
+        yield session
+        session.commit()
+
+    # Пачка выдач и изъятий предметов - одна запись (повтор id - несколько штук)
+    def update_inventory(self, user_id: str, add: Iterable[str] = (), remove: Iterable[str] = ()):
+        from inventory import Inventory
+
+        inventory = Inventory(self.get_user(user_id)["inventory"])
+        if inventory.apply(add, remove):
+            self.update_user(user_id, {"inventory": inventory.to_list()})
 
     def add_item(self, user_id: str, item_id: str):
-        user = self.get_user(user_id)
-        if item_id not in user["inventory"]:
-            user["inventory"].append(item_id)
-            self.update_user(user_id, {"inventory": user["inventory"]})
+        self.update_inventory(user_id, add=[item_id])
 
     def remove_item(self, user_id: str, item_id: str):
-        user = self.get_user(user_id)
-        if item_id in user["inventory"]:
-            user["inventory"].remove(item_id)
-            self.update_user(user_id, {"inventory": user["inventory"]})
\ No newline at end of file
+        self.update_inventory(user_id, remove=[item_id])
+
+
+class UserSession:
+    def __init__(self, storage: BaseStorage, user_id: str, data: Dict[str, Any] = None):
+        self.storage = storage
+        self.user_id = str(user_id)
+        # Рабочая копия игрока, изменения видны в ней сразу
+        self.data = data if data is not None else storage.get_user(self.user_id)
+        self._changed = set()
+        self._inventory = None
+
+    def update(self, updates: Dict[str, Any]):
+        BaseStorage._apply_updates(self.data, updates)
+        self._changed.update(updates)
+        if "inventory" in updates:
+            self._inventory = None
+
+    # Инвентарь строится из списка один раз за сессию
+    @property
+    def inventory(self):
+        if self._inventory is None:
+            from inventory import Inventory
+            self._inventory = Inventory(self.data.get("inventory", ()))
+        return self._inventory
+
+    def update_inventory(self, add: Iterable[str] = (), remove: Iterable[str] = ()):
+        inventory = self.inventory
+        if inventory.apply(add, remove):
+            self.update({"inventory": inventory.to_list()})
+            self._inventory = inventory
+
+    def add_item(self, item_id: str, quantity: int = 1):
+        self.update_inventory(add=[item_id] * quantity)
+
+    def remove_item(self, item_id: str, quantity: int = 1):
+        self.update_inventory(remove=[item_id] * quantity)
+
+    def commit(self):
+        if self._changed:
+            self.storage.update_user(self.user_id, {key: self.data[key] for key in self._changed})
+            self._changed.clear()
+
+
+# Все игроки в одном JSON-файле. Файл перезаписывается атомарно (временный файл + fsync +
+# переименование), предыдущий снимок остается резервной копией filename.bak.
+# При flush_interval > 0 изменения копит фоновый поток и пишет их одним снимком и одним fsync
+class Storage(BaseStorage):
+    def __init__(self, filename="data/users.json", flush_interval=0, compact=False):
+        self.filename = filename
+        self.backup_filename = filename + ".bak"
+        # Сколько секунд изменения могут копиться в памяти до записи на диск (0 - писать сразу)
+        self.flush_interval = flush_interval
+        # Компактный режим: в памяти PlayerState, в файле записи без имен полей
+        self.compact = compact
+        self._users = None
+        self._dirty = set()
+        # Закодированные записи игроков для снимка: при записи заново кодируются только
+        # игроки из _dirty, а склеивается и пишется снимок уже без блокировки
+        self._entries: Dict[str, bytes] = {}
+        # Основной файл оказался битым: при следующей записи он откладывается в сторону, а не в .bak
+        self._corrupted = False
+        self._lock = threading.RLock()
+        # Снимки пишутся по одному и в том порядке, в котором сняты
+        self._flush_lock = threading.Lock()
+        self._ensure_directory()
+        self._ensure_file()
+
+        self._flusher = None
+        if 0 < flush_interval < float("inf"):
+            self._stop_flusher = threading.Event()
+            self._flusher = threading.Thread(target=self._flush_loop, name="storage-flusher", daemon=True)
+            self._flusher.start()
+
+    def _ensure_directory(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+    def _ensure_file(self):
+        # Без основного файла, но с копией - значит, упали между двумя переименованиями.
+        # Пустой файл без копии - новая база (в репозитории data/users.json лежит пустым)
+        if os.path.exists(self.backup_filename):
+            return
+        if not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0:
+            self._write_snapshot(self._encode({}))
+
+    def _read_snapshot(self, path: str):
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        self._count_io(read=len(payload))
+        try:
+            users = json.loads(payload)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            users = None
+        if not isinstance(users, dict):
+            raise ValueError(f"Файл {path} поврежден")
+        return users
+
+    # Читает основной файл, а если он битый или пропал - резервную копию.
+    # Если повреждены оба, бот не запускается: пустая база затерла бы всех игроков
+    def load_all_users(self) -> Dict[str, Any]:
+        errors = []
+        for path in (self.filename, self.backup_filename):
+            try:
+                users = self._read_snapshot(path)
+            except ValueError as error:
+                errors.append(str(error))
+                continue
+            if users is None:
+                continue
+            if errors:
+                logger.error("%s; игроки загружены из резервной копии %s", errors[0], path)
+                self._corrupted = True
+            return users
+
+        if errors:
+            raise ValueError("Не удалось загрузить игроков: " + "; ".join(errors))
+        return {}
+
+    def _encode(self, data: Dict[str, Any]) -> bytes:
+        if self.compact:
+            return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def save_all_users(self, data: Dict[str, Any]):
+        self._write_snapshot(self._encode(data))
+
+    # Запись одного игрока в том же виде, что и в полном снимке
+    def _encode_entry(self, user_id: str, record) -> bytes:
+        return self._encode({user_id: record})[1:-1].strip(b"\n")
+
+    # Все записи разом: один json.dumps с отступами в разы быстрее, чем вызов на каждого игрока.
+    # Записи верхнего уровня разделены ',\n  "': в строках JSON нет переводов строки,
+    # а у вложенных полей отступ больше двух пробелов
+    def _encode_entries(self, records: Dict[str, Any]) -> Dict[str, bytes]:
+        if records and not self.compact:
+            parts = self._encode(records)[2:-2].split(b',\n  "')
+            if len(parts) == len(records):
+                return dict(zip(records, [parts[0]] + [b'  "' + part for part in parts[1:]]))
+        return {user_id: self._encode_entry(user_id, record) for user_id, record in records.items()}
+
+    def _join_entries(self, entries: List[bytes]) -> bytes:
+        if not entries:
+            return self._encode({})
+        if self.compact:
+            return b"{" + b",".join(entries) + b"}"
+        return b"{\n" + b",\n".join(entries) + b"\n}"
+
+    # Новый снимок сначала целиком ложится на диск во временный файл, затем прошлый снимок
+    # становится резервной копией, а новый - основным файлом. При падении на любом шаге
+    # на диске остается целый основной файл или целая копия
+    def _write_snapshot(self, payload: bytes):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._count_io(written=len(payload))
+        self._install_snapshot(temp_filename)
+
+    def _install_snapshot(self, temp_filename: str):
+        if os.path.exists(self.filename):
+            if self._corrupted:
+                os.replace(self.filename, f"{self.filename}.corrupt-{time.time_ns()}")
+                self._corrupted = False
+            else:
+                os.replace(self.filename, self.backup_filename)
+        os.replace(temp_filename, self.filename)
+        self._count_io(fsyncs=1 + self._fsync_directory())
+
+    # Переименование надежно только после fsync каталога (на Windows так нельзя, и не нужно)
+    def _fsync_directory(self) -> int:
+        if not hasattr(os, "O_DIRECTORY"):
+            return 0
+        fd = os.open(os.path.dirname(self.filename) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return 1
+
+    # Все пользователи держатся в памяти, файл читается один раз
+    def _cache(self) -> Dict[str, Any]:
+        if self._users is None:
+            users = self.load_all_users()
+            # Файл может быть в любом из двух форматов, приводим записи к текущему режиму
+            for user_id, record in users.items():
+                if self.compact or isinstance(record, list):
+                    users[user_id] = self._to_state(record)
+                    if not self.compact:
+                        users[user_id] = users[user_id].to_dict()
+            self._users = users
+            self._entries = self._encode_entries(self._snapshot())
+        return self._users
+
+    @staticmethod
+    def _to_state(record):
+        from player_state import PlayerState
+
+        if isinstance(record, list):
+            return PlayerState.from_compact(record)
+        return PlayerState.from_dict(record)
+
+    def _mark_dirty(self, user_id: str):
+        self._dirty.add(user_id)
+
+    # Данные для записи в файл в формате текущего режима
+    def _snapshot(self) -> Dict[str, Any]:
+        if self.compact:
+            return {user_id: state.to_compact() for user_id, state in self._users.items()}
+        return self._users
+
+    # Вызывается под self._lock. Весь кэш кодируется один раз при загрузке (_cache),
+    # дальше - только изменившиеся игроки, поэтому блокировка не зависит от числа игроков
+    def _snapshot_entries(self) -> List[bytes]:
+        for user_id in self._dirty:
+            record = self._users.get(user_id)
+            if record is None:
+                self._entries.pop(user_id, None)
+            else:
+                self._entries[user_id] = self._encode_entry(user_id, record.to_compact() if self.compact else record)
+        return list(self._entries.values())
+
+    # Все изменения, накопленные с прошлой записи, уходят на диск одним снимком
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = self._snapshot_entries()
+                pending = self._dirty
+                self._dirty = set()
+
+            try:
+                self._write_snapshot(self._join_entries(entries))
+            except OSError:
+                # Не записали - изменения остаются несохраненными до следующей попытки
+                with self._lock:
+                    self._dirty |= pending
+                raise
+
+    def _flush_loop(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Не удалось записать %s", self.filename)
+
+    def close(self):
+        if self._flusher is not None:
+            self._stop_flusher.set()
+            self._flusher.join()
+        self.flush()
+
+    def get_user(self, user_id: str) -> Dict[str, Any]:
+        with self._lock:
+            users = self._cache()
+            user_data = users.get(str(user_id))
+
+            created = not user_data
+            if created:
+                # Создаем нового пользователя с дефолтными значениями
+                user_data = self._create_default_user(user_id)
+                users[str(user_id)] = self._to_state(user_data) if self.compact else user_data
+                self._mark_dirty(str(user_id))
+            elif self.compact:
+                user_data = user_data.to_dict()
+
+            # Отдаем копию, чтобы изменения вне update_user не попадали в кэш
+            user_data = copy.deepcopy(user_data)
+
+        if created and not self.flush_interval:
+            self.flush()
+        return user_data
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            user_ids = list(self._cache())
+        for user_id in user_ids:
+            yield self.get_user(user_id)
+
+    def _record_to_dict(self, user_id: str, record) -> Dict[str, Any]:
+        if isinstance(record, list):
+            return self._to_state(record).to_dict()
+        return {**record, "user_id": record.get("user_id", user_id)}
+
+    # Если кэш в этом процессе не загружен (утилиты обслуживания при остановленном боте),
+    # файл читается потоково и целиком в память не попадает
+    def scan(self) -> Iterator[Dict[str, Any]]:
+        if self._users is not None:
+            yield from self.iter_users()
+            return
+        path = self.filename if os.path.exists(self.filename) else self.backup_filename
+        for user_id, record in iter_json_users(path):
+            yield self._record_to_dict(user_id, record)
+
+    # Без загруженного кэша игроки переписываются потоком в новый снимок,
+    # который затем атомарно занимает место основного файла
+    def bulk_update(self, select, chunk_size: int = 500) -> int:
+        if self._users is not None:
+            return super().bulk_update(select, chunk_size)
+
+        path = self.filename if os.path.exists(self.filename) else self.backup_filename
+        temp_filename = self.filename + ".tmp"
+        separator = b"," if self.compact else b",\n"
+        updated = 0
+        written = 0
+        with open(temp_filename, 'wb') as f:
+            f.write(b"{" if self.compact else b"{\n")
+            for index, (user_id, record) in enumerate(iter_json_users(path)):
+                user_data = self._record_to_dict(user_id, record)
+                updates = select(copy.deepcopy(user_data))
+                if updates:
+                    self._apply_updates(user_data, updates)
+                    updated += 1
+                if self.compact:
+                    user_data = self._to_state(user_data).to_compact()
+                entry = self._encode_entry(user_id, user_data)
+                if index:
+                    f.write(separator)
+                f.write(entry)
+                written += len(entry) + len(separator)
+            f.write(b"}" if self.compact else b"\n}")
+            f.flush()
+            os.fsync(f.fileno())
+
+        if not updated:
+            os.remove(temp_filename)
+            return 0
+        self._count_io(written=written)
+        self._install_snapshot(temp_filename)
+        return updated
+
+    def update_user(self, user_id: str, updates: Dict[str, Any]):
+        with self._lock:
+            users = self._cache()
+            user_id_str = str(user_id)
+
+            if user_id_str not in users:
+                users[user_id_str] = self._create_default_user(user_id_str)
+            elif self.compact:
+                users[user_id_str] = users[user_id_str].to_dict()
+
+            self._apply_updates(users[user_id_str], updates)
+            if self.compact:
+                users[user_id_str] = self._to_state(users[user_id_str])
+            self._mark_dirty(user_id_str)
+
+        # Запись вне блокировки кэша, чтобы не пересекаться с фоновой записью
+        if not self.flush_interval:
+            self.flush()
+
+    def delete_user(self, user_id: str):
+        with self._lock:
+            if self._cache().pop(str(user_id), None) is None:
+                return
+            self._mark_dirty(str(user_id))
+
+        if not self.flush_interval:
+            self.flush()
+
+
+# JSON-хранилище с журналом: каждое изменение дописывается одной строкой в файл журнала,
+# а фоновый поток периодически сворачивает журнал в снимок users.json.
+# При запуске состояние = снимок + повтор журнала. Записи журнала задают значения полей,
+# поэтому повторное применение одной и той же записи безопасно
+class JournaledStorage(Storage):
+    def __init__(self, filename="data/users.json", compact_interval=300, archive_dir="", compact=False):
+        # Файл целиком не переписывается при изменениях, они уже в журнале
+        super().__init__(filename, flush_interval=float("inf"), compact=compact)
+        self.journal_filename = filename + ".journal"
+        # Журнал, который сейчас сворачивается в снимок
+        self.rotated_filename = filename + ".journal.old"
+        self.compact_interval = compact_interval
+        # Куда складывать свернутые журналы для анализа прохождения; пусто - удалять
+        self.archive_dir = archive_dir
+        self._compact_lock = threading.Lock()
+
+        if self._replay():
+            # Журнал прошлого запуска (или незавершенное сворачивание): сразу пишем свежий снимок
+            self._write_snapshot(self._join_entries(self._snapshot_entries()))
+            self._dirty.clear()
+            for path in (self.rotated_filename, self.journal_filename):
+                if os.path.exists(path):
+                    self._retire(path)
+        self._journal = open(self.journal_filename, 'ab')
+
+        self._stop = threading.Event()
+        self._compactor = threading.Thread(target=self._compact_loop, name="journal-compactor", daemon=True)
+        self._compactor.start()
+
+    def _replay(self) -> int:
+        self._cache()
+        replayed = 0
+        for path in (self.rotated_filename, self.journal_filename):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                for line in f:
+                    self._count_io(read=len(line))
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Оборванная последняя строка после падения
+                        break
+                    if record["d"] is None:
+                        Storage.delete_user(self, record["u"])
+                    else:
+                        Storage.update_user(self, record["u"], record["d"])
+                    replayed += 1
+        return replayed
+
+    # updates = None - игрок удален
+    def _append(self, user_id: str, updates: Optional[Dict[str, Any]]):
+        record = {"t": round(time.time(), 3), "u": user_id, "d": updates}
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n"
+        self._journal.write(line)
+        self._journal.flush()
+        self._count_io(written=len(line))
+
+    def get_user(self, user_id: str) -> Dict[str, Any]:
+        with self._lock:
+            is_new = str(user_id) not in self._cache()
+            user_data = super().get_user(user_id)
+            if is_new:
+                # Пустая запись при повторе создает игрока с дефолтными значениями
+                self._append(str(user_id), {})
+            return user_data
+
+    def update_user(self, user_id: str, updates: Dict[str, Any]):
+        with self._lock:
+            super().update_user(user_id, updates)
+            self._append(str(user_id), updates)
+
+    def delete_user(self, user_id: str):
+        with self._lock:
+            if str(user_id) in self._cache():
+                super().delete_user(user_id)
+                self._append(str(user_id), None)
+
+    def flush(self):
+        with self._lock:
+            self._journal.flush()
+
+    # Свернутый журнал уходит в архив или удаляется
+    def _retire(self, path: str):
+        if self.archive_dir:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            os.replace(path, os.path.join(self.archive_dir, f"journal-{time.time_ns()}.jsonl"))
+        else:
+            os.remove(path)
+
+    def compact_journal(self):
+        with self._compact_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = self._snapshot_entries()
+                self._journal.close()
+                os.replace(self.journal_filename, self.rotated_filename)
+                self._journal = open(self.journal_filename, 'ab')
+                self._dirty.clear()
+
+            # Снимок склеивается и пишется вне блокировки: новые изменения уже идут в свежий журнал
+            self._write_snapshot(self._join_entries(entries))
+            self._retire(self.rotated_filename)
+
+    def _compact_loop(self):
+        while not self._stop.wait(self.compact_interval):
+            self.compact_journal()
+
+    def close(self):
+        self._stop.set()
+        self.compact_journal()
+        with self._lock:
+            self._journal.close()
+
+
+# Асинхронная обертка для хендлеров бота: вся работа с диском идет в отдельном потоке,
+# поэтому медленная запись не останавливает событийный цикл
+class AsyncStorage:
+    def __init__(self, storage: BaseStorage, workers=1):
+        self.storage = storage
+        # По умолчанию один поток: бэкенды не рассчитаны на одновременный доступ из нескольких потоков.
+        # Шардированное хранилище защищает каждый шард сам, ему можно дать поток на шард
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="storage")
+        # Блокировка на каждого игрока: апдейты разных игроков идут параллельно,
+        # а чтение-изменение-запись одного игрока не перетирают друг друга
+        self._locks = weakref.WeakValueDictionary()
+
+    def lock(self, user_id: str) -> asyncio.Lock:
+        user_id = str(user_id)
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._timed, func, *args))
+
+    # Время самой операции в потоке хранилища, без ожидания в очереди исполнителя
+    @staticmethod
+    def _timed(func, *args):
+        with metrics.timer("storage_call_seconds", method=func.__name__):
+            return func(*args)
+
+    async def get_user(self, user_id: str) -> Dict[str, Any]:
+        return await self._run(self.storage.get_user, user_id)
+
+    async def update_user(self, user_id: str, updates: Dict[str, Any]):
+        async with self.lock(user_id):
+            await self._run(self.storage.update_user, user_id, updates)
+
+    async def add_item(self, user_id: str, item_id: str):
+        async with self.lock(user_id):
+            await self._run(self.storage.add_item, user_id, item_id)
+
+    async def remove_item(self, user_id: str, item_id: str):
+        async with self.lock(user_id):
+            await self._run(self.storage.remove_item, user_id, item_id)
+
+    async def update_inventory(self, user_id: str, add: Iterable[str] = (), remove: Iterable[str] = ()):
+        async with self.lock(user_id):
+            await self._run(self.storage.update_inventory, user_id, list(add), list(remove))
+
+    async def flush(self):
+        await self._run(self.storage.flush)
+
+    async def close(self):
+        await self._run(self.storage.close)
+        self._executor.shutdown()
+
+    @asynccontextmanager
+    async def session(self, user_id: str):
+        async with self.lock(user_id):
+            session = UserSession(self.storage, user_id, await self.get_user(user_id))
+            yield session
+            await self._run(session.commit)
+
+
+# Потоковое чтение JSON-объекта {user_id: запись, ...}: пары отдаются по одной,
+# в памяти только текущий блок файла и текущая запись
+def iter_json_users(filename: str, chunk_size: int = 1 << 16) -> Iterator[Tuple[str, Any]]:
+    decoder = json.JSONDecoder()
+    with open(filename, 'r', encoding='utf-8') as f:
+        buffer = ""
+        position = 0
+
+        def read_more() -> bool:
+            nonlocal buffer, position
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return False
+            buffer = buffer[position:] + chunk
+            position = 0
+            return True
+
+        def peek() -> str:
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n":
+                    position += 1
+                if position < len(buffer):
+                    return buffer[position]
+                if not read_more():
+                    return ""
+
+        def read_value():
+            nonlocal position
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if read_more():
+                        continue
+                    raise
+                # Число на границе блока могло прочитаться не полностью
+                if end == len(buffer) and read_more():
+                    continue
+                position = end
+                return value
+
+        first = peek()
+        if not first:
+            return
+        if first != "{":
+            raise ValueError(f"{filename}: ожидался JSON-объект")
+        position += 1
+        while True:
+            char = peek()
+            if char == "}":
+                return
+            if char == ",":
+                position += 1
+                continue
+            user_id = read_value()
+            if peek() != ":":
+                raise ValueError(f"{filename}: поврежден рядом с записью {user_id}")
+            position += 1
+            peek()
+            yield user_id, read_value()
+
+
+# Имя файла шарда: data/users.json -> data/users.2-of-4.json (без шардов имя не меняется)
+def shard_filename(filename: str, index: int, count: int) -> str:
+    if count == 1:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{index}-of-{count}{ext}"
+
+
+# Создает один бэкенд хранилища (или один его шард)
+# evict_interval=0 - без фонового вытеснения в холодный ярус (admin.py, reshard: бот остановлен,
+# и игроки не должны переезжать между ярусами, пока утилита их читает)
+def create_backend(backend: str, index=0, count=1, flush_interval=None, evict_interval=None) -> BaseStorage:
+    from config import (
+        JSON_FILE, SQLITE_FILE, FLUSH_INTERVAL, COMPACT_USERS,
+        JOURNAL_COMPACT_INTERVAL, JOURNAL_ARCHIVE_DIR,
+        COLD_AFTER, MAX_HOT_USERS, COLD_DIR, EVICT_INTERVAL
+    )
+
+    if flush_interval is None:
+        flush_interval = FLUSH_INTERVAL
+    if evict_interval is None:
+        evict_interval = EVICT_INTERVAL
+    json_file = shard_filename(JSON_FILE, index, count)
+
+    if backend == "json":
+        storage = Storage(json_file, flush_interval=flush_interval, compact=COMPACT_USERS)
+    elif backend == "journal":
+        storage = JournaledStorage(json_file, compact_interval=JOURNAL_COMPACT_INTERVAL,
+                                   archive_dir=JOURNAL_ARCHIVE_DIR, compact=COMPACT_USERS)
+    elif backend == "sqlite":
+        from sqlite_storage import SqliteStorage
+        storage = SqliteStorage(shard_filename(SQLITE_FILE, index, count))
+    else:
+        raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
+
+    if COLD_AFTER or MAX_HOT_USERS:
+        from tiered_storage import ColdStorage, TieredStorage
+        cold = ColdStorage(shard_filename(COLD_DIR, index, count))
+        storage = TieredStorage(storage, cold, idle_ttl=COLD_AFTER, max_hot=MAX_HOT_USERS,
+                                evict_interval=evict_interval)
+    return storage
+
+
+# Создает хранилище согласно настройкам STORAGE_BACKEND и STORAGE_SHARDS в config.py
+def create_storage(evict_interval=None) -> BaseStorage:
+    from config import STORAGE_BACKEND, STORAGE_SHARDS, STORAGE_OWNED_SHARDS
+
+    if STORAGE_SHARDS == 1:
+        return create_backend(STORAGE_BACKEND, evict_interval=evict_interval)
+
+    from sharding import ShardedStorage
+    return ShardedStorage(
+        lambda index: create_backend(STORAGE_BACKEND, index, STORAGE_SHARDS, evict_interval=evict_interval),
+        STORAGE_SHARDS,
+        owned=STORAGE_OWNED_SHARDS
+    )
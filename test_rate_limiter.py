@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import time
+import unittest
+
+from telegram.error import RetryAfter
+
+from fake_telegram import create_fake_bot
+from metrics import metrics
+from rate_limiter import FloodRateLimiter
+
+# Планировщик проверяется на поддельном Bot API: запросы проходят через настоящий ExtBot,
+# а 429 Too Many Requests с retry_after = 1 с отвечает FakeRequest (flood_every).
+# python -m unittest test_rate_limiter
+
+# Запас на неточность таймеров цикла событий
+EPSILON = 0.05
+
+
+class FloodRateLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def send_all(self, rate_limiter: FloodRateLimiter, chat_ids, flood_every: int = 0):
+        bot, request = await create_fake_bot(rate_limiter, flood_every)
+        started = time.monotonic()
+        sent_at = []
+
+        async def send(chat_id):
+            await bot.send_message(chat_id, f"to {chat_id}")
+            sent_at.append(time.monotonic() - started)
+
+        await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+        await bot.shutdown()
+        return sorted(sent_at), request
+
+    async def test_retry_after_pauses_and_retries(self):
+        rate_limiter = FloodRateLimiter(global_rate=100, chat_rate=100, chat_burst=100)
+        retry_after_total = metrics.total("telegram_rate_limit_retry_after_total")
+        # Третий sendMessage получает 429: он повторяется после паузы, а не теряется
+        sent_at, request = await self.send_all(rate_limiter, [1, 2, 3], flood_every=3)
+
+        self.assertEqual(len(sent_at), 3)
+        self.assertEqual(request.calls["429"], 1)
+        self.assertEqual(request.calls["sendMessage"], 4)
+        self.assertEqual(rate_limiter.stats["retry_after"], 1)
+        self.assertEqual(rate_limiter.stats["failed"], 0)
+        self.assertGreaterEqual(sent_at[-1], request.retry_after - EPSILON)
+        # Пауза видна и в общих метриках (/metrics, METRICS_PATH)
+        self.assertEqual(metrics.total("telegram_rate_limit_retry_after_total") - retry_after_total, 1)
+        self.assertIn('telegram_rate_limit_retry_after_total{endpoint="sendMessage"}', metrics.render())
+
+    async def test_retry_after_pauses_other_chats(self):
+        rate_limiter = FloodRateLimiter(global_rate=100, chat_rate=100, chat_burst=100)
+        bot, request = await create_fake_bot(rate_limiter)
+        rate_limiter._pause(request.retry_after)
+
+        # Пауза после 429 действует на весь бот, а не только на чат, где он случился
+        started = time.monotonic()
+        await bot.send_message(2, "other chat")
+        self.assertGreaterEqual(time.monotonic() - started, request.retry_after - EPSILON)
+        await bot.shutdown()
+
+    async def test_retry_after_pauses_other_workers(self):
+        shared_pause = multiprocessing.get_context("spawn").Value("d", 0.0)
+        worker = FloodRateLimiter(global_rate=100, chat_rate=100, chat_burst=100, max_retries=0,
+                                  shared_pause=shared_pause)
+        other = FloodRateLimiter(global_rate=100, chat_rate=100, chat_burst=100, shared_pause=shared_pause)
+
+        # 429 у одного воркера кластера останавливает отправку и у остальных
+        with self.assertRaises(RetryAfter):
+            await self.send_all(worker, [1], flood_every=1)
+        sent_at, _ = await self.send_all(other, [2])
+        self.assertGreaterEqual(sent_at[0], 1 - EPSILON)
+
+    async def test_retry_after_gives_up_after_max_retries(self):
+        rate_limiter = FloodRateLimiter(global_rate=100, chat_rate=100, chat_burst=100, max_retries=0)
+        with self.assertRaises(RetryAfter):
+            await self.send_all(rate_limiter, [1], flood_every=1)
+
+        self.assertEqual(rate_limiter.stats["failed"], 1)
+
+    async def test_global_rate(self):
+        rate = 20
+        rate_limiter = FloodRateLimiter(global_rate=rate, chat_rate=100, chat_burst=100)
+        # Разные чаты: сдерживает только общее ведро, в котором поначалу rate токенов
+        sent_at, _ = await self.send_all(rate_limiter, range(1, 51))
+
+        self.assertGreaterEqual(sent_at[-1], (50 - rate) / rate - EPSILON)
+        for index, start in enumerate(sent_at):
+            in_second = sum(1 for moment in sent_at[index:] if moment < start + 1)
+            self.assertLessEqual(in_second, 2 * rate + 1)
+
+    async def test_private_chat_rate(self):
+        rate_limiter = FloodRateLimiter(global_rate=100, chat_rate=5, chat_burst=2)
+        sent_at, _ = await self.send_all(rate_limiter, [1] * 7 + [2])
+
+        # Первые chat_burst сообщений в чат уходят сразу, остальные - не чаще chat_rate в секунду
+        self.assertLess(sent_at[2], 0.1)
+        self.assertGreaterEqual(sent_at[-1], (7 - 2) / 5 - EPSILON)
+        for previous, current in zip(sent_at[3:], sent_at[4:]):
+            self.assertGreaterEqual(current - previous, 1 / 5 - EPSILON)
+
+    async def test_other_chat_is_not_delayed(self):
+        rate_limiter = FloodRateLimiter(global_rate=100, chat_rate=5, chat_burst=1)
+        bot, _ = await create_fake_bot(rate_limiter)
+        busy = asyncio.gather(*(bot.send_message(1, "busy") for _ in range(5)))
+        await asyncio.sleep(0)
+
+        started = time.monotonic()
+        await bot.send_message(2, "other chat")
+        self.assertLess(time.monotonic() - started, 0.1)
+        await busy
+        await bot.shutdown()
+
+    async def test_group_chat_rate(self):
+        rate_limiter = FloodRateLimiter(global_rate=100, chat_rate=100, chat_burst=100, group_rate=5)
+        sent_at, _ = await self.send_all(rate_limiter, [-100] * 3)
+
+        # У групп лимит строже и без запаса подряд
+        self.assertGreaterEqual(sent_at[1], 1 / 5 - EPSILON)
+        self.assertGreaterEqual(sent_at[2], 2 / 5 - EPSILON)
+
+
+if __name__ == "__main__":
+    unittest.main()
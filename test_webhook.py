@@ -0,0 +1,87 @@
+import asyncio
+import json
+import unittest
+
+from telegram import Update
+from telegram.ext import Application
+
+from fake_telegram import create_fake_bot, make_message_update
+from webhook import WebhookServer
+
+# Вебхук проверяется настоящими HTTP-запросами к WebhookServer на свободном порту.
+# python -m unittest test_webhook
+
+PATH = "/telegram"
+SECRET = "secret"
+
+
+class WebhookServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        bot, _ = await create_fake_bot()
+        self.application = Application.builder().bot(bot).updater(None).build()
+        self.server = WebhookServer(self.application, "127.0.0.1", 0, PATH, SECRET)
+        await self.server.start()
+        port = self.server._server.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.server.stop()
+        await self.application.bot.shutdown()
+
+    # Запросы идут по одному соединению: после ошибки оно должно остаться рабочим
+    async def request(self, body: bytes, method: str = "POST", path: str = PATH, secret: str = SECRET) -> int:
+        headers = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+        if secret:
+            headers += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+        self.writer.write((headers + "\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line = await asyncio.wait_for(self.reader.readline(), 5)
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        await self.reader.readexactly(length)
+        return int(status_line.split()[1])
+
+    async def test_update_is_queued(self):
+        data = make_message_update(1, 42, "/start")
+        self.assertEqual(await self.request(json.dumps(data).encode("utf-8")), 200)
+
+        update = self.application.update_queue.get_nowait()
+        self.assertIsInstance(update, Update)
+        self.assertEqual(update.effective_user.id, 42)
+
+    async def test_malformed_json_object_is_rejected(self):
+        bodies = [
+            {"update_id": 5, "message": 5},
+            {"update_id": 7, "callback_query": "x"},
+            {"update_id": 1, "message": {"chat": 5}},
+            {"update_id": 1, "message": {"message_id": 1, "date": 10 ** 20, "chat": {"id": 1, "type": "private"}}},
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                self.assertEqual(await self.request(json.dumps(body).encode("utf-8")), 400)
+        self.assertTrue(self.application.update_queue.empty())
+
+    async def test_not_an_update_is_rejected(self):
+        for body in (b"null", b"[]", b"{}", b"5", b'"x"', b"{", b"\xff"):
+            with self.subTest(body=body):
+                self.assertEqual(await self.request(body), 400)
+        self.assertTrue(self.application.update_queue.empty())
+
+    async def test_wrong_request_is_rejected(self):
+        body = json.dumps(make_message_update(1, 42, "/start")).encode("utf-8")
+        self.assertEqual(await self.request(body, secret="wrong"), 403)
+        self.assertEqual(await self.request(body, path="/other"), 404)
+        self.assertEqual(await self.request(b"", method="GET"), 405)
+        self.assertTrue(self.application.update_queue.empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
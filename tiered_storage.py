@@ -0,0 +1,322 @@
+import copy
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from metrics import metrics
+from storage import BaseStorage
+
+logger = logging.getLogger(__name__)
+
+
+# Холодный ярус: давно не заходившие игроки в сжатых gzip-файлах, разложенных по хэшу user_id.
+# Чтобы достать одного игрока, читается только его файл (1/buckets всех холодных игроков)
+class ColdStorage(BaseStorage):
+    def __init__(self, directory="data/cold", buckets=256):
+        self.directory = directory
+        self.buckets = buckets
+        # Файлы меняются чтением-изменением-записью, одновременные изменения потеряли бы друг друга
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, user_id: str) -> str:
+        index = zlib.crc32(str(user_id).encode('utf-8')) % self.buckets
+        return os.path.join(self.directory, f"{index:03d}.json.gz")
+
+    def _read_bucket(self, path: str) -> Dict[str, Any]:
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return {}
+        self._count_io(read=len(payload))
+        return json.loads(gzip.decompress(payload))
+
+    # Файл переписывается атомарно, как и снимок users.json: временный файл, fsync, переименование
+    def _write_bucket(self, path: str, users: Dict[str, Any]):
+        if not users:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        payload = gzip.compress(
+            json.dumps(users, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), compresslevel=6
+        )
+        temp_filename = path + ".tmp"
+        with open(temp_filename, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, path)
+        self._count_io(written=len(payload), fsyncs=1)
+
+    def _fsync_directory(self):
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._count_io(fsyncs=1)
+
+    def _by_bucket(self, user_ids: Iterable[str]) -> Dict[str, list]:
+        buckets = {}
+        for user_id in user_ids:
+            buckets.setdefault(self._path(user_id), []).append(str(user_id))
+        return buckets
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._read_bucket(self._path(user_id)).get(str(user_id))
+
+    # Каждый затронутый файл читается и переписывается один раз на всю пачку
+    def put_many(self, users: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            for path, user_ids in self._by_bucket(users).items():
+                bucket = self._read_bucket(path)
+                for user_id in user_ids:
+                    bucket[user_id] = users[user_id]
+                self._write_bucket(path, bucket)
+            if users:
+                self._fsync_directory()
+
+    def remove_many(self, user_ids: Iterable[str]):
+        with self._lock:
+            for path, ids in self._by_bucket(user_ids).items():
+                bucket = self._read_bucket(path)
+                removed = [bucket.pop(user_id) for user_id in ids if user_id in bucket]
+                if removed:
+                    self._write_bucket(path, bucket)
+
+    def delete_user(self, user_id: str):
+        self.remove_many([user_id])
+
+    def bucket_paths(self) -> List[str]:
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.endswith(".json.gz")]
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        for path in self.bucket_paths():
+            for user_id, user_data in self._read_bucket(path).items():
+                yield {**user_data, "user_id": user_id}
+
+    # Чтение, изменение и запись одного файла под блокировкой, чтобы между ними его не переписали.
+    # change(user_id, user_data) меняет запись на месте и возвращает, изменилась ли она
+    def update_bucket(self, path: str, change: Callable[[str, Dict[str, Any]], bool]) -> int:
+        with self._lock:
+            bucket = self._read_bucket(path)
+            changed = sum(1 for user_id, user_data in bucket.items() if change(user_id, user_data))
+            if changed:
+                self._write_bucket(path, bucket)
+                self._fsync_directory()
+        return changed
+
+
+# Горячий и холодный ярусы поверх любого бэкенда. В основном хранилище остаются только
+# недавно активные игроки; игроки, простаивающие idle_ttl секунд, и самые давние сверх max_hot
+# фоновым потоком переносятся в ColdStorage и возвращаются обратно при следующем обращении.
+# Время последнего изменения пишется в запись игрока полем last_seen
+class TieredStorage(BaseStorage):
+    def __init__(self, hot: BaseStorage, cold: ColdStorage, idle_ttl: float = 0, max_hot: int = 0,
+                 evict_interval: float = 60):
+        self.hot = hot
+        self.cold = cold
+        self.idle_ttl = idle_ttl
+        self.max_hot = max_hot
+        self.evict_interval = evict_interval
+        self._lock = threading.RLock()
+        # Вытеснение не идет, пока игроки меняются пакетом: иначе игрок мог бы
+        # перейти между ярусами посреди изменения и получить его дважды или потерять
+        self._bulk_lock = threading.Lock()
+        # Горячие игроки от давно не заходивших к недавним: user_id -> время последнего обращения
+        self._last_seen: "OrderedDict[str, float]" = OrderedDict()
+        # Вернулись из холодного яруса, но их старая копия еще не удалена из него.
+        # Удаляется, когда возвращение уже записано в горячий ярус
+        self._rehydrated = set()
+
+        started = time.time()
+        # Игроки, записанные до появления last_seen, считаются заходившими сейчас
+        seen = sorted((user.get("last_seen") or started, str(user["user_id"])) for user in hot.scan())
+        for last_seen, user_id in seen:
+            self._last_seen[user_id] = last_seen
+
+        self._evictor = None
+        if evict_interval > 0 and (idle_ttl or max_hot):
+            self._stop_evictor = threading.Event()
+            self._evictor = threading.Thread(target=self._evict_loop, name="storage-evictor", daemon=True)
+            self._evictor.start()
+
+    def _touch(self, user_id: str):
+        self._last_seen[user_id] = time.time()
+        self._last_seen.move_to_end(user_id)
+
+    def _rehydrate(self, user_id: str):
+        if user_id in self._last_seen:
+            return
+        user_data = self.cold.get(user_id)
+        if user_data is not None:
+            self.hot.update_user(user_id, user_data)
+            self._rehydrated.add(user_id)
+            metrics.inc("storage_rehydrated_total")
+
+    def get_user(self, user_id: str) -> Dict[str, Any]:
+        user_id = str(user_id)
+        with self._lock:
+            self._rehydrate(user_id)
+            self._touch(user_id)
+            return self.hot.get_user(user_id)
+
+    def update_user(self, user_id: str, updates: Dict[str, Any]):
+        user_id = str(user_id)
+        with self._lock:
+            self._rehydrate(user_id)
+            self._touch(user_id)
+            self.hot.update_user(user_id, {**updates, "last_seen": int(self._last_seen[user_id])})
+
+    def delete_user(self, user_id: str):
+        user_id = str(user_id)
+        with self._lock:
+            self.hot.delete_user(user_id)
+            self._last_seen.pop(user_id, None)
+            self._rehydrated.discard(user_id)
+        self.cold.delete_user(user_id)
+
+    def _pick_victims(self) -> Dict[str, float]:
+        now = time.time()
+        victims = {}
+        for user_id, last_seen in self._last_seen.items():
+            over_capacity = self.max_hot and len(self._last_seen) - len(victims) > self.max_hot
+            idle = self.idle_ttl and now - last_seen >= self.idle_ttl
+            if not (over_capacity or idle):
+                break
+            # Старую холодную копию вернувшегося игрока сначала нужно удалить
+            if user_id not in self._rehydrated:
+                victims[user_id] = last_seen
+        return victims
+
+    # Один проход вытеснения: сколько игроков ушло в холодный ярус
+    def evict(self) -> int:
+        with self._bulk_lock:
+            return self._evict()
+
+    def _evict(self) -> int:
+        with self._lock:
+            self.hot.flush()
+            stale = self._rehydrated
+            self._rehydrated = set()
+        self.cold.remove_many(stale)
+
+        with self._lock:
+            victims = self._pick_victims()
+            users = {user_id: self.hot.get_user(user_id) for user_id in victims}
+        if not users:
+            return 0
+
+        # Сжатые файлы пишутся без блокировки; из горячего яруса игрок удаляется, только
+        # когда он уже надежно лежит в холодном и за это время не обращался к боту
+        self.cold.put_many(users)
+        evicted = 0
+        with self._lock:
+            for user_id, last_seen in victims.items():
+                if self._last_seen.get(user_id) == last_seen:
+                    self.hot.delete_user(user_id)
+                    del self._last_seen[user_id]
+                    evicted += 1
+            self.hot.flush()
+        metrics.inc("storage_evicted_total", evicted)
+        return evicted
+
+    def _evict_loop(self):
+        while not self._stop_evictor.wait(self.evict_interval):
+            try:
+                evicted = self.evict()
+            except OSError:
+                logger.exception("Не удалось перенести игроков в %s", self.cold.directory)
+                continue
+            if evicted:
+                logger.info("В холодное хранилище перенесено игроков: %s, в памяти: %s",
+                            evicted, len(self._last_seen))
+
+    # Сначала горячие игроки, затем холодные, которых нет среди горячих
+    def scan(self) -> Iterator[Dict[str, Any]]:
+        yield from self.hot.scan()
+        for user_data in self.cold.scan():
+            if str(user_data["user_id"]) not in self._last_seen:
+                yield user_data
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        return self.scan()
+
+    # Холодные игроки меняются прямо в сжатых файлах, не возвращаясь в горячий ярус:
+    # файл за файлом, каждый читается и переписывается целиком, прежде чем браться за следующий.
+    # Горячий ярус - после холодного: игроки, вернувшиеся из уже измененного файла, пропускаются
+    def bulk_update(self, select, chunk_size: int = 500) -> int:
+        done = set()
+
+        def change(user_id: str, user_data: Dict[str, Any]) -> bool:
+            # Вернувшийся игрок будет изменен в горячем ярусе, его холодная копия устарела
+            if user_id in self._last_seen:
+                return False
+            updates = select(copy.deepcopy({**user_data, "user_id": user_id}))
+            if not updates:
+                return False
+            self._apply_updates(user_data, updates)
+            done.add(user_id)
+            return True
+
+        def select_hot(user_data: Dict[str, Any]):
+            return None if str(user_data["user_id"]) in done else select(user_data)
+
+        with self._bulk_lock:
+            for path in self.cold.bucket_paths():
+                # Пока файл меняется, его игроков нельзя вернуть в горячий ярус
+                with self._lock:
+                    self.cold.update_bucket(path, change)
+            return len(done) + self._bulk_update_hot(select_hot, chunk_size)
+
+    # Горячий ярус пачками по chunk_size: блокировка держится только на чтение и запись
+    # одной пачки, между пачками бот обслуживает игроков
+    def _bulk_update_hot(self, select, chunk_size: int) -> int:
+        with self._lock:
+            user_ids = list(self._last_seen)
+        updated = 0
+        for start in range(0, len(user_ids), chunk_size):
+            with self._lock:
+                chunk = []
+                for user_id in user_ids[start:start + chunk_size]:
+                    # Удален, пока шли предыдущие пачки
+                    if user_id not in self._last_seen:
+                        continue
+                    updates = select(self.hot.get_user(user_id))
+                    if updates:
+                        chunk.append((user_id, updates))
+                updated += self.hot._apply_chunk(chunk)
+        return updated
+
+    def flush(self):
+        with self._lock:
+            self.hot.flush()
+
+    def close(self):
+        if self._evictor is not None:
+            self._stop_evictor.set()
+            self._evictor.join()
+        with self._lock:
+            self.hot.close()
+
+    @property
+    def bytes_written(self) -> int:
+        return self.hot.bytes_written + self.cold.bytes_written
+
+    @property
+    def bytes_read(self) -> int:
+        return self.hot.bytes_read + self.cold.bytes_read
+
+    @property
+    def fsyncs(self) -> int:
+        return self.hot.fsyncs + self.cold.fsyncs
@@ -0,0 +1,50 @@
+import json
+import os
+import time
+from typing import Any, Dict, Iterator
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+
+# Запись входящих апдейтов для воспроизведения в replay.py. Одна строка JSON на апдейт:
+# {"t": время получения (unix, секунды с точностью до мс), "u": апдейт в формате Bot API}.
+# Файл дописывается, каждая строка сразу уходит в ОС, чтобы трасса пережила падение бота
+class TraceRecorder:
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.recorded = 0
+        self._file = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    async def record(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        line = json.dumps({"t": round(time.time(), 3), "u": update.to_dict()},
+                          ensure_ascii=False, separators=(",", ":"))
+        self._file.write(line + "\n")
+        self._file.flush()
+        self.recorded += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_trace(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Оборванная последняя строка после падения
+                return
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import json
+import logging
+import signal
+from typing import Dict, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Бот реагирует только на сообщения и кнопки, остальные типы апдейтов Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# Больше Telegram не присылает, всё крупнее - мусор
+MAX_BODY_SIZE = 1024 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+# Минимальный HTTP-сервер для вебхука Telegram: принимает POST с апдейтом и кладет его
+# в update_queue приложения. Очередь ограничена: если она заполнена, сервер держит запрос
+# до put_timeout секунд (Telegram в это время не шлет новые апдейты по этому соединению),
+# а потом отвечает 503, и Telegram повторит доставку позже.
+# GET metrics_path отдает метрики бота в текстовом формате Prometheus
+class WebhookServer:
+    def __init__(self, application: Application, listen: str, port: int, path: str,
+                 secret_token: str = "", put_timeout: float = 5, metrics_path: str = ""):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.put_timeout = put_timeout
+        self.metrics_path = metrics_path
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info("Вебхук слушает http://%s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, extra_headers, response_body = await self._process(method, target, headers, body)
+                close = headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, extra_headers, close, response_body)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _process(self, method: str, target: str, headers: Dict[str, str],
+                       body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        path = target.split("?", 1)[0]
+        if self.metrics_path and path == self.metrics_path and method == "GET":
+            return 200, {"Content-Type": "text/plain; version=0.0.4"}, metrics.render().encode('utf-8')
+        if path != self.path:
+            return 404, {}, b""
+        if method != "POST":
+            return 405, {"Allow": "POST"}, b""
+        if self.secret_token and headers.get("x-telegram-bot-api-secret-token") != self.secret_token:
+            return 403, {}, b""
+
+        try:
+            data = json.loads(body)
+            # Апдейт - только JSON-объект; на null, [] и {} de_json молча возвращает None
+            update = Update.de_json(data, self.application.bot) if isinstance(data, dict) else None
+        except Exception:
+            # Поля не того типа роняют de_json чем угодно (AttributeError, OverflowError...),
+            # а запрос все равно должен получить ответ
+            update = None
+        if update is None:
+            logger.warning("Не удалось разобрать апдейт: %r", body[:200])
+            return 400, {}, b""
+
+        try:
+            await asyncio.wait_for(self.application.update_queue.put(update), self.put_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Очередь апдейтов переполнена, просим Telegram повторить позже")
+            return 503, {"Retry-After": "1"}, b""
+        return 200, {}, b""
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, extra_headers: Dict[str, str] = None,
+                       close: bool = False, body: bytes = b""):
+        headers = {"Content-Length": str(len(body)), "Connection": "close" if close else "keep-alive"}
+        headers.update(extra_headers or {})
+        response = f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        response += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write((response + "\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+
+# Запуск бота через вебхук вместо run_polling. url - публичный адрес, на который Telegram
+# шлет апдейты (например, через обратный прокси); пустой url - не регистрировать вебхук
+async def run_webhook(application: Application, url: str, listen: str, port: int, path: str,
+                      secret_token: str = "", allowed_updates=None, max_connections: int = 40,
+                      metrics_path: str = ""):
+    server = WebhookServer(application, listen, port, path, secret_token, metrics_path=metrics_path)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await server.start()
+    try:
+        if url:
+            await application.bot.set_webhook(
+                url=url + path,
+                allowed_updates=allowed_updates,
+                secret_token=secret_token or None,
+                max_connections=max_connections,
+            )
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+if __name__ == "__main__":
+    # Локальная проверка без сети: python webhook.py --port 8080
+    # и затем curl -X POST -d @update.json http://127.0.0.1:8080/telegram
+    import bot
+    from config import WEBHOOK_PATH, UPDATE_QUEUE_SIZE, METRICS_PATH
+    from fake_telegram import create_fake_bot
+
+    parser = argparse.ArgumentParser(description="Вебхук бота с поддельным Bot API")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    async def run_offline():
+        bot.open_storage()
+        fake_bot, _ = await create_fake_bot()
+        builder = (
+            Application.builder()
+            .bot(fake_bot)
+            .updater(None)
+            .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+            .post_init(bot.on_startup)
+            .post_shutdown(bot.on_shutdown)
+        )
+        if bot.PERSISTENCE:
+            builder = builder.persistence(bot.create_persistence())
+        application = builder.build()
+        bot.register_handlers(application)
+        await run_webhook(application, "", "127.0.0.1", args.port, WEBHOOK_PATH, metrics_path=METRICS_PATH)
+
+    asyncio.run(run_offline())